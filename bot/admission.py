@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+from bot.metrics import MetricsRegistry
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# What happens to a new message when the queue is full: "delay" waits for a
+# free slot, "drop_oldest" drops the oldest message of the busiest channel,
+# "low_priority" moves that message to a lane served only when all channel
+# queues are empty. The lane holds up to `capacity` messages of its own
+OVERLOAD_POLICIES = ("delay", "drop_oldest", "low_priority")
+
+class FairQueue:
+    def __init__(self, capacity: int = 100, policy: str = "delay",
+                 weights: Optional[Dict[int, float]] = None,
+                 metrics: Optional[MetricsRegistry] = None,
+                 max_delayed: Optional[int] = None):
+        """
+        Initializes the admission queue of the message pipeline. Every
+        channel has its own queue, and the channels take turns by deficit
+        round robin, so a channel that posts a burst does not delay the
+        messages of the others.
+
+        :param capacity: The maximum number of messages in the channel queues,
+                         0 for no limit. The "low_priority" lane can hold as
+                         many again, so that policy queues up to twice as many.
+        :param policy: The overload policy, one of OVERLOAD_POLICIES.
+        :param weights: The share of turns by channel ID, 1 for channels
+                        that are not listed.
+        :param metrics: Registry for the overload counters.
+        :param max_delayed: The maximum number of messages waiting for a free
+                            slot under the "delay" policy, `capacity` by
+                            default. Beyond it the oldest message of the
+                            busiest channel is dropped.
+        """
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown overload policy {policy}, expected one of {OVERLOAD_POLICIES}.")
+        if any(weight <= 0 for weight in (weights or {}).values()):
+            raise ValueError("Channel weights must be positive.")
+        self.capacity = capacity
+        self.policy = policy
+        self.weights = weights or {}
+        self.metrics = metrics or MetricsRegistry()
+        self.max_delayed = capacity if max_delayed is None else max_delayed
+
+        # Channels with queued messages in the order of their turns
+        self._lanes: "OrderedDict[int, deque]" = OrderedDict()
+        self._deficits: Dict[int, float] = {}
+        self._low_priority: deque = deque()
+        self._size = 0
+        self._overloaded = False
+        self._delayed = 0
+        self._changed = asyncio.Condition()
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self) -> int:
+        """Returns the number of queued messages, including the low-priority lane."""
+        return self._size + len(self._low_priority)
+
+    def low_priority_size(self) -> int:
+        """Returns the number of messages in the low-priority lane."""
+        return len(self._low_priority)
+
+    def delayed(self) -> int:
+        """Returns the number of messages waiting for a free slot under the "delay" policy."""
+        return self._delayed
+
+    def lengths(self) -> Dict[int, int]:
+        """
+        Returns the number of queued messages of every channel with queued messages.
+
+        :returns: A dictionary with channel IDs as keys.
+        """
+        return {channel_id: len(lane) for channel_id, lane in self._lanes.items()}
+
+    async def put(self, channel_id: int, item: Any, wait: bool = False) -> None:
+        """
+        Queues a message of a channel. When the queue is full, the overload
+        policy decides what happens.
+
+        :param channel_id: The ID of the channel.
+        :param item: The queued message.
+        :param wait: Whether to wait for a free slot whatever the policy is,
+                     e.g. for missed messages that are not time-critical.
+        """
+        async with self._changed:
+            if self._full():
+                if not self._overloaded:
+                    self._overloaded = True
+                    logger.warning(f"Pipeline queue is full with {self._size} message(s), "
+                                   f"applying the '{self.policy}' policy.")
+                if wait:
+                    self.metrics.increment("admission_delayed")
+                    await self._changed.wait_for(lambda: not self._full())
+                elif self.policy == "delay" and self._delayed < self.max_delayed:
+                    # Every delayed message holds up the handler that received it
+                    self.metrics.increment("admission_delayed")
+                    self._delayed += 1
+                    try:
+                        await self._changed.wait_for(lambda: not self._full())
+                    finally:
+                        self._delayed -= 1
+                else:
+                    self._shed()
+
+            self._lanes.setdefault(channel_id, deque()).append(item)
+            self._deficits.setdefault(channel_id, 0.0)
+            self._size += 1
+            self._unfinished += 1
+            self._finished.clear()
+            self._changed.notify_all()
+
+    def _full(self) -> bool:
+        return 0 < self.capacity <= self._size
+
+    def _shed(self) -> None:
+        """
+        Frees a slot by dropping or demoting the oldest message of the busiest
+        channel. Only "low_priority" demotes, every other policy drops.
+        """
+        channel_id = max(self._lanes, key=lambda channel: len(self._lanes[channel]))
+        item = self._lanes[channel_id].popleft()
+        self._size -= 1
+        if not self._lanes[channel_id]:
+            del self._lanes[channel_id], self._deficits[channel_id]
+
+        if self.policy == "low_priority":
+            self.metrics.increment("admission_shed")
+            self._low_priority.append((channel_id, item))
+            if len(self._low_priority) <= self.capacity:
+                return
+            channel_id, item = self._low_priority.popleft()
+
+        logger.debug(f"Dropped a queued message of channel {channel_id}.")
+        self.metrics.increment("admission_dropped")
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._finished.set()
+
+    async def get(self) -> Any:
+        """
+        Takes the next message, waiting for one if the queue is empty.
+
+        :returns: The queued message.
+        """
+        async with self._changed:
+            await self._changed.wait_for(self.qsize)
+            if self._lanes:
+                item = self._take()
+            else:
+                _, item = self._low_priority.popleft()
+            if not self._full():
+                self._overloaded = False
+            self._changed.notify_all()
+            return item
+
+    def _take(self) -> Any:
+        """Takes the next message of the channel whose turn it is."""
+        # A channel gets its weight in credit per turn and sends a message for every full credit
+        while True:
+            channel_id = next(iter(self._lanes))
+            if self._deficits[channel_id] >= 1:
+                break
+            self._deficits[channel_id] += self.weights.get(channel_id, 1.0)
+            if self._deficits[channel_id] >= 1:
+                break
+            self._lanes.move_to_end(channel_id)
+
+        lane = self._lanes[channel_id]
+        item = lane.popleft()
+        self._deficits[channel_id] -= 1
+        self._size -= 1
+        if not lane:
+            # An idle channel does not save up credit
+            del self._lanes[channel_id], self._deficits[channel_id]
+        elif self._deficits[channel_id] < 1:
+            self._lanes.move_to_end(channel_id)
+        return item
+
+    def task_done(self) -> None:
+        """Marks a message taken by get() as processed."""
+        self._unfinished -= 1
+        if not self._unfinished:
+            self._finished.set()
+
+    async def join(self) -> None:
+        """Waits until every queued message has been processed or dropped."""
+        await self._finished.wait()
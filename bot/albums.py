@@ -0,0 +1,97 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telethon.events import NewMessage
+
+from bot.metrics import MetricsRegistry
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# Telegram allows at most this many messages in one album
+MAX_ALBUM_SIZE = 10
+
+class AlbumAssembler:
+    def __init__(self, emit: Callable[[NewMessage, List[int]], Awaitable[None]],
+                 timeout_ms: float = 500, metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize the in-memory album assembler. Parts of an album arrive as
+        separate new message events with the same grouped ID; they are
+        buffered until no new part has arrived for the timeout and then
+        emitted together.
+
+        :param emit: Coroutine function called with the part that carries the
+                     album text and the IDs of all parts.
+        :param timeout_ms: The time in milliseconds to wait for more parts
+                           after the last one.
+        :param metrics: Registry for the time from the first part to the emit.
+        """
+        self.emit = emit
+        self.timeout = timeout_ms / 1000
+        self.metrics = metrics
+        self._parts: Dict[Tuple[int, int], List[NewMessage]] = {}
+        self._started: Dict[Tuple[int, int], float] = {}
+        self._timers: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def add(self, event: NewMessage) -> None:
+        """
+        Buffers a part of an album and restarts the timeout of its album.
+
+        :param event: The new message event of the part.
+        """
+        key = (event.chat_id, event.message.grouped_id)
+        self._parts.setdefault(key, []).append(event)
+        self._started.setdefault(key, time.perf_counter())
+
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        # A full album cannot get more parts, so it is emitted right away
+        if len(self._parts[key]) >= MAX_ALBUM_SIZE:
+            self._complete(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.timeout, self._complete, key
+            )
+
+    def _complete(self, key: Tuple[int, int]) -> None:
+        """
+        Takes the buffered parts of the album and starts emitting it.
+
+        :param key: The channel ID and grouped ID of the album.
+        """
+        self._timers.pop(key, None)
+        parts = self._parts.pop(key, [])
+        started = self._started.pop(key, None)
+        if self.metrics is not None and started is not None:
+            self.metrics.observe("album", time.perf_counter() - started)
+        if parts:
+            asyncio.get_running_loop().create_task(self._emit(key, parts))
+
+    async def _emit(self, key: Tuple[int, int], parts: List[NewMessage]) -> None:
+        """
+        Emits the album as one unit of work.
+
+        :param key: The channel ID and grouped ID of the album.
+        :param parts: The new message events of all parts.
+        """
+        parts.sort(key=lambda part: part.message.id)
+        message_ids = [part.message.id for part in parts]
+
+        # The album text is the caption of one of its parts, usually the first
+        text_part = next((part for part in parts if part.message.text), None)
+        if text_part is None:
+            logger.info(f"Album {key[1]} of {len(parts)} message(s) has no text. Skipping.")
+            return
+
+        logger.info(f"Collected {len(parts)} messages with grouped ID {key[1]}.")
+        try:
+            await self.emit(text_part, message_ids)
+        except Exception as e:
+            logger.error(f"Failed to emit album {key[1]}: {e}")
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Optional
+
+from bot.config import MainConfig
+from bot.logger import setup_logger
+from bot.corpus import DEFAULT_CORPUS_PATH
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# Values used for settings that are missing from the configuration
+DEFAULTS = {"torch_threads": 0, "torch_interop_threads": 0, "tokenizers_parallelism": None,
+            "batch_size": 16, "lemma_batch_size": 64}
+
+def available_cores() -> int:
+    """Returns the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def candidate_values(cores: int) -> Dict[str, List]:
+    """
+    Returns the values tried for every setting, in the order the settings
+    are tuned.
+
+    :param cores: The number of available cores.
+    :returns: The candidate values by setting name.
+    """
+    threads = sorted({value for value in (1, 2, 4, 8, 16, cores) if value <= cores})
+    return {
+        "torch_threads": threads,
+        "torch_interop_threads": sorted({value for value in (1, 2, cores) if value <= cores}),
+        "tokenizers_parallelism": [False, True],
+        "batch_size": [8, 16, 32],
+        "lemma_batch_size": [32, 64, 128],
+    }
+
+def measure(config_path: str, corpus_path: str, limit: int, settings: Dict) -> float:
+    """
+    Runs the benchmark with the settings in a new process, since PyTorch
+    fixes some of its threads for the lifetime of a process.
+
+    :param config_path: The main configuration file.
+    :param corpus_path: Directory with the replayed messages.
+    :param limit: The number of replayed messages.
+    :param settings: The bot settings to override.
+    :returns: The throughput in messages per second, 0 if the run failed.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "benchmark.json")
+        command = [sys.executable, "-m", "bot.benchmark", "--config", config_path,
+                   "--corpus", corpus_path, "--limit", str(limit), "--output", output_path]
+        for key, value in settings.items():
+            command += ["--set", f"{key}={json.dumps(value)}"]
+
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.error(f"Benchmark with {settings} failed: {result.stderr.strip()[-500:]}")
+            return 0.0
+        with open(output_path, 'r', encoding='utf-8') as file:
+            return json.load(file)["messages_per_sec"]
+
+def tune(config_path: str, corpus_path: str, limit: int, repeats: int = 1,
+         rounds: int = 1, base: Optional[Dict] = None) -> Dict:
+    """
+    Finds the fastest settings one at a time: every candidate value of a
+    setting is measured with the best values found so far for the others.
+
+    :param config_path: The main configuration file.
+    :param corpus_path: Directory with the replayed messages.
+    :param limit: The number of replayed messages.
+    :param repeats: The number of runs per candidate, the median counts.
+    :param rounds: The number of passes over all settings.
+    :param base: The settings to start from.
+    :returns: The best settings and their throughput.
+    """
+    cores = available_cores()
+    candidates = candidate_values(cores)
+    best = dict(base or {})
+    results: Dict[str, float] = {}
+    logger.info(f"Tuning {', '.join(candidates)} on {cores} core(s) with {limit} messages.")
+
+    def score(settings: Dict) -> float:
+        key = json.dumps(settings, sort_keys=True)
+        if key not in results:
+            results[key] = statistics.median(measure(config_path, corpus_path, limit, settings)
+                                             for _ in range(repeats))
+            logger.info(f"{results[key]:8.1f} messages/s with {settings}")
+        return results[key]
+
+    for _ in range(rounds):
+        for name, values in candidates.items():
+            scores = {json.dumps(value): score({**best, name: value}) for value in values}
+            best[name] = json.loads(max(scores, key=scores.get))
+
+    return {"settings": best, "messages_per_sec": score(best), "cores": cores}
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Find the fastest thread and batch settings for this machine.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with messages.")
+    parser.add_argument('--limit', type=int, default=500, help="Messages replayed per run.")
+    parser.add_argument('--repeats', type=int, default=1, help="Runs per candidate.")
+    parser.add_argument('--rounds', type=int, default=1, help="Passes over all settings.")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the best settings.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    base = {key: config.bot_settings.get(key, default) for key, default in DEFAULTS.items()}
+    tuned = tune(args.config, args.corpus, args.limit, args.repeats, args.rounds, base)
+    if not tuned["messages_per_sec"]:
+        logger.error("No benchmark run succeeded, the configuration is left unchanged.")
+        return
+    logger.info(f"Best settings for {tuned['cores']} core(s): {tuned['settings']} "
+                f"({tuned['messages_per_sec']:.1f} messages/s).")
+
+    if not args.dry_run:
+        config.save_tuned(tuned["settings"])
+
+
+if __name__ == "__main__":
+    main()
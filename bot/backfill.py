@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Awaitable, Callable, Collection, Dict, List
+
+from telethon import TelegramClient
+from telethon.events import NewMessage
+
+from bot.db import DuckDBHandler
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class ChannelProgress:
+    def __init__(self, db_handler: DuckDBHandler):
+        """
+        Initializes the record of the last processed message of every channel.
+        Updates are kept in memory and written to the database by flush().
+
+        :param db_handler: Database handler storing the progress.
+        """
+        self.db_handler = db_handler
+        self.lock = threading.Lock()
+        self._last_ids: Dict[int, int] = self.db_handler.get_channel_progress()
+        self._changed: Dict[int, int] = {}
+        logger.info(f"Loaded the progress of {len(self._last_ids)} channel(s).")
+
+    def get(self, channel_id: int) -> int:
+        """
+        Returns the ID of the last processed message of the channel.
+
+        :param channel_id: The ID of the channel.
+        :returns: The message ID, or 0 if the channel is unknown.
+        """
+        with self.lock:
+            return self._last_ids.get(channel_id, 0)
+
+    def snapshot(self) -> Dict[int, int]:
+        """
+        Returns a copy of the last processed message of every channel.
+
+        :returns: A dictionary with channel IDs as keys and message IDs as values.
+        """
+        with self.lock:
+            return dict(self._last_ids)
+
+    def update(self, channel_id: int, message_id: int) -> None:
+        """
+        Records a processed message if it is newer than the last one.
+
+        :param channel_id: The ID of the channel.
+        :param message_id: The ID of the processed message.
+        """
+        with self.lock:
+            if message_id > self._last_ids.get(channel_id, 0):
+                self._last_ids[channel_id] = self._changed[channel_id] = message_id
+
+    def flush(self) -> None:
+        """Writes the progress changed since the last flush to the database."""
+        with self.lock:
+            changed, self._changed = self._changed, {}
+        if not changed:
+            return
+
+        try:
+            self.db_handler.update_channel_progress(changed)
+        except Exception:
+            # Keep the changes so the next flush retries them
+            with self.lock:
+                for channel_id, message_id in changed.items():
+                    self._changed.setdefault(channel_id, message_id)
+            raise
+
+class Backfill:
+    def __init__(self, client: TelegramClient, progress: ChannelProgress,
+                 queue_message: Callable[[NewMessage, List[int]], Awaitable[None]],
+                 exclude_channels: Collection[int], concurrency: int = 4, limit: int = 500,
+                 owns_channel: Callable[[int], bool] = lambda channel_id: True):
+        """
+        Initialize the catch-up stage that processes the messages published
+        while the bot was not running.
+
+        :param client: The Telegram client instance.
+        :param progress: The last processed message of every channel.
+        :param queue_message: Coroutine function that queues a message event
+                              with the IDs of all messages to forward.
+        :param exclude_channels: The channels that are never processed.
+        :param concurrency: The number of channels fetched at the same time.
+        :param limit: The maximum number of missed messages fetched per channel.
+        :param owns_channel: Whether a channel is processed by this shard.
+        """
+        self.client = client
+        self.progress = progress
+        # Live messages advance the progress while the backfill runs, so the
+        # gaps are taken from the progress at startup
+        self.last_ids = progress.snapshot()
+        self.queue_message = queue_message
+        self.exclude_channels = exclude_channels
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limit = limit
+        self.owns_channel = owns_channel
+
+    async def run(self) -> None:
+        """Fetches the missed messages of all subscribed channels and queues them."""
+        channels = []
+        async for dialog in self.client.iter_dialogs():
+            if not dialog.is_channel or dialog.id in self.exclude_channels \
+                    or not self.owns_channel(dialog.id):
+                continue
+
+            if dialog.id in self.last_ids:
+                channels.append(dialog)
+            elif dialog.message is not None:
+                # Without a record there is no known gap, so start counting from now
+                self.progress.update(dialog.id, dialog.message.id)
+
+        logger.info(f"Backfilling missed messages of {len(channels)} channel(s).")
+        counts = await asyncio.gather(*(self._backfill_channel(dialog) for dialog in channels))
+        logger.info(f"Backfill queued {sum(counts)} missed post(s).")
+
+    async def _backfill_channel(self, dialog) -> int:
+        """
+        Fetches the messages of one channel newer than its last processed
+        message and queues them oldest first, with albums as one unit.
+
+        :param dialog: The dialog of the channel.
+        :returns: The number of queued posts.
+        """
+        async with self.semaphore:
+            last_id = self.last_ids[dialog.id]
+            try:
+                messages = [message async for message in
+                            self.client.iter_messages(dialog.entity, min_id=last_id, limit=self.limit)]
+            except Exception as e:
+                logger.error(f"Failed to fetch missed messages of {dialog.id}: {e}")
+                return 0
+
+        if len(messages) == self.limit:
+            logger.warning(f"Channel {dialog.id} missed more than {self.limit} messages, "
+                           f"only the newest are processed.")
+
+        # Collect the parts of every album and keep the order of publication
+        albums: Dict[int, List] = defaultdict(list)
+        units = []
+        for message in reversed(messages):
+            if message.grouped_id is None:
+                units.append([message])
+            else:
+                if message.grouped_id not in albums:
+                    units.append(albums[message.grouped_id])
+                albums[message.grouped_id].append(message)
+
+        queued = 0
+        for parts in units:
+            text_part = next((part for part in parts if part.text), None)
+            if text_part is None:
+                continue
+            await self.queue_message(NewMessage.Event(text_part), [part.id for part in parts])
+            queued += 1
+        return queued
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Callable, List, Tuple
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# The classifier imports PyTorch, which is loaded together with the model
+if TYPE_CHECKING:
+    from bot.classifier import TextClassifier
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    def __init__(self, batch_function: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 10, name: str = "batch",
+                 concurrency: int = 1):
+        """
+        Initialize the batching front end around a function that processes a
+        list of items. Requests are collected until the batch is full or the
+        oldest request has waited long enough, and then processed in one call.
+
+        :param batch_function: Function returning one result per item, in order.
+        :param max_batch_size: The maximum number of items in one batch.
+        :param max_wait_ms: The maximum time in milliseconds a request waits
+                            for the batch to fill up.
+        :param name: The name used for the worker thread and in logs.
+        :param concurrency: The number of batches processed at the same time,
+                            e.g. the number of worker processes behind the function.
+        """
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.concurrency = concurrency
+
+        # Batches run in their own threads, at most `concurrency` at a time
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer = None
+        self._running = 0
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queues the item and waits for its result.
+
+        :param item: The item to process.
+        :returns: The result for the item.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._schedule()
+        return await future
+
+    def _schedule(self) -> None:
+        """Starts a batch if it is full, otherwise waits for more requests."""
+        # A running batch starts the next one when it completes
+        if self._running >= self.concurrency or not self._pending:
+            return
+
+        if len(self._pending) >= self.max_batch_size:
+            self._start_batch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait,
+                                                                self._start_batch)
+
+    def _start_batch(self) -> None:
+        """Takes up to a full batch of pending requests and starts processing."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # A batch that completes takes the pending requests if all slots are busy
+        if self._running >= self.concurrency:
+            return
+
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        self._running += 1
+        asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+        # Start more batches while there are free slots
+        self._schedule()
+
+    async def _run_batch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """
+        Processes the batch in the worker thread and resolves the futures
+        of the waiting callers.
+
+        :param batch: A list of items with the futures waiting for their results.
+        """
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.batch_function, items
+            )
+        except Exception as e:
+            logger.error(f"Failed to process a {self.name} of {len(batch)} items: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            logger.debug(f"Processed a {self.name} of {len(batch)} items.")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._running -= 1
+
+        # Requests that arrived during processing have already waited for a
+        # full batch, so they are started right away
+        if self._pending:
+            self._start_batch()
+
+class BatchingClassifier(MicroBatcher):
+    def __init__(self, classifier: "TextClassifier", max_batch_size: int = 16,
+                 max_wait_ms: float = 10, bucket_by_length: bool = True,
+                 embeddings: bool = False, concurrency: int = 1):
+        """
+        Initialize the batching front end around the text classifier.
+
+        :param classifier: The text classifier used for inference.
+        :param max_batch_size: The maximum number of texts in one batch.
+        :param max_wait_ms: The maximum time in milliseconds a request waits
+                            for the batch to fill up.
+        :param bucket_by_length: Whether to group texts of similar length.
+        :param embeddings: Whether every batch also computes the sentence
+                           embeddings of the texts.
+        :param concurrency: The number of batches classified at the same time.
+        """
+        super().__init__(self._classify_batch, max_batch_size, max_wait_ms, "classifier", concurrency)
+        self.classifier = classifier
+        self.bucket_by_length = bucket_by_length
+        self.embeddings = embeddings
+
+    def _classify_batch(self, texts: List[str]) -> List[Tuple[int, np.ndarray]]:
+        """
+        Classifies a batch of texts.
+
+        :param texts: The preprocessed texts to classify.
+        :returns: A list of (class index, embedding) tuples, the embedding is
+                  None unless embeddings are enabled.
+        """
+        if self.embeddings:
+            return self.classifier.classify_with_embeddings_batch(texts, self.max_batch_size,
+                                                                  self.bucket_by_length)
+        categories = self.classifier.classify_batch(texts, self.max_batch_size, self.bucket_by_length)
+        return [(category, None) for category in categories]
+
+    async def classify(self, text: str) -> int:
+        """
+        Queues the text for classification and waits for its class.
+
+        :param text: The preprocessed text to classify.
+        :returns: The predicted class index as an integer.
+        """
+        category, _ = await self.submit(text)
+        return category
+
+    async def classify_with_embedding(self, text: str) -> Tuple[int, np.ndarray]:
+        """
+        Queues the text and waits for its class and sentence embedding.
+
+        :param text: The preprocessed text to classify.
+        :returns: The predicted class index and the unit embedding.
+        """
+        if not self.embeddings:
+            raise RuntimeError("The batching classifier was created without embeddings.")
+        return await self.submit(text)
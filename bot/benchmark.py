@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import datetime
+import resource
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import yaml
+from telethon import utils
+from telethon.events import NewMessage
+from telethon.tl.types import Message, PeerChannel
+
+from bot.db import DuckDBHandler
+from bot.logger import setup_logger
+from bot.metrics import MetricsRegistry
+from bot.telegram_bot import MessageHandler
+from bot.config import MainConfig, TelegramConfig
+from bot.corpus import DEFAULT_CORPUS_PATH, iter_corpus
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+FAKE_FORUM_ID = -1000000000001
+
+class FakeTelegramClient:
+    def __init__(self, forward_latency_ms: float = 0):
+        """
+        Initialize the stand-in for TelegramClient that records forward
+        requests instead of sending them.
+
+        :param forward_latency_ms: The simulated duration of one API request.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.parse_mode = None
+        self.forward_latency = forward_latency_ms / 1000
+        self.handlers = []
+        self.forwards: List[Dict] = []
+
+    def add_event_handler(self, callback, event=None) -> None:
+        self.handlers.append(callback)
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.forward_latency)
+        self.forwards.append({"from_peer": request.from_peer, "ids": list(request.id),
+                              "topic": request.top_msg_id})
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def iter_dialogs(self):
+        # The benchmark has no subscribed channels to backfill
+        return
+        yield
+
+def make_event(client: FakeTelegramClient, message: Dict) -> NewMessage.Event:
+    """
+    Converts a corpus message into a new message event dated now.
+
+    :param client: The fake client, needed to render the message text.
+    :param message: A message dictionary from the corpus.
+    :returns: The new message event.
+    """
+    channel_id, _ = utils.resolve_id(int(message["sender_id"]))
+    telegram_message = Message(
+        id=int(message["message_id"]),
+        peer_id=PeerChannel(channel_id),
+        date=datetime.datetime.now(datetime.timezone.utc),
+        message=message["text"],
+        post=True
+    )
+    telegram_message._client = client
+    return NewMessage.Event(telegram_message)
+
+def load_replay(corpus_path: str, limit: Optional[int]) -> List[Dict]:
+    """
+    Loads the corpus messages in the order they were published.
+
+    :param corpus_path: Directory with the '<channel_id>_messages.json(l)' files.
+    :param limit: The maximum number of messages.
+    :returns: A list of message dictionaries.
+    """
+    messages = sorted(iter_corpus(corpus_path), key=lambda message: message["date"])
+    return messages[:limit] if limit else messages
+
+def git_commit() -> Optional[str]:
+    """Returns the current commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def replay(config: MainConfig, messages: List[Dict], rate: float, burst: int,
+                 forward_latency_ms: float, db_path: str) -> Dict:
+    """
+    Replays the messages through the full message handler pipeline.
+
+    :param config: The main configuration with the benchmark overrides applied.
+    :param messages: The corpus messages to replay.
+    :param rate: The average arrival rate in messages per second, 0 for no limit.
+    :param burst: The number of messages arriving at once.
+    :param forward_latency_ms: The simulated duration of one API request.
+    :param db_path: The database file used by the pipeline.
+    :returns: The benchmark results.
+    """
+    client = FakeTelegramClient(forward_latency_ms)
+    db_handler = DuckDBHandler(db_file=db_path)
+
+    # Give every category a topic so that accepted messages are forwarded
+    telegram_config = TelegramConfig(os.path.join(os.path.dirname(db_path), "bot_config.yaml"), True)
+    telegram_config.config = {
+        "forum_id": FAKE_FORUM_ID,
+        "topics": [{"id": 1000 + int(category), "category": int(category)}
+                   for category in config.categories]
+    }
+
+    start_time = time.perf_counter()
+    metrics = MetricsRegistry(max_samples=None)
+    handler = MessageHandler(client, config, telegram_config, db_handler, metrics)
+    await handler.startup
+    load_time = time.perf_counter() - start_time
+    logger.info(f"Pipeline loaded in {load_time:.1f}s, replaying {len(messages)} messages.")
+
+    # Send the messages in bursts, spacing the bursts to match the arrival rate
+    start_time = time.perf_counter()
+    for start in range(0, len(messages), burst):
+        for message in messages[start:start + burst]:
+            await handler.handler(make_event(client, message))
+        if rate > 0:
+            next_burst = start_time + (start + burst) / rate
+            await asyncio.sleep(max(0.0, next_burst - time.perf_counter()))
+
+    # Wait until every message has been processed and forwarded
+    await handler.queue.join()
+    while handler.forwarder.queue_depth() or len(handler.albums):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start_time
+
+    await client.loop.run_in_executor(handler.executor, handler.window.flush)
+    db_handler.close()
+
+    return {
+        "messages": len(messages),
+        "load_s": load_time,
+        "elapsed_s": elapsed,
+        "messages_per_sec": len(messages) / elapsed,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "forward_requests": len(client.forwards),
+        "forwarded_messages": sum(len(forward["ids"]) for forward in client.forwards),
+        **metrics.summary()
+    }
+
+def main() -> None:
+    # Set up the logger
+    setup_logger(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Replay the corpus through the message pipeline.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with messages.")
+    parser.add_argument('--limit', type=int, default=2000, help="Number of messages, 0 for all.")
+    parser.add_argument('--rate', type=float, default=0, help="Arrival rate in messages/s, 0 for no limit.")
+    parser.add_argument('--burst', type=int, default=1, help="Messages arriving at once.")
+    parser.add_argument('--forward-latency-ms', type=float, default=50,
+                        help="Simulated duration of one forward request.")
+    parser.add_argument('--set', action='append', default=[], metavar="KEY=VALUE",
+                        help="Override a bot setting, e.g. --set classifier_backend=onnx.")
+    parser.add_argument('--output', default="benchmark.json", help="File for the JSON results.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    overrides = {"backfill": False, "forward_rate": 1000, "forward_burst": 1000,
+                 "metrics_port": 0, "metrics_log_interval": 0, "config_reload_interval": 0}
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        overrides[key] = yaml.safe_load(value)
+    config.config["bot_settings"] = {**config.bot_settings, **overrides}
+
+    messages = load_replay(args.corpus, args.limit)
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(replay(config, messages, args.rate, args.burst,
+                                     args.forward_latency_ms, os.path.join(directory, "messages.db")))
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "arrival": {"rate": args.rate, "burst": args.burst,
+                    "forward_latency_ms": args.forward_latency_ms},
+        "settings": overrides,
+        **results
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+    logger.info(f"{results['messages']} messages in {results['elapsed_s']:.1f}s: "
+                f"{results['messages_per_sec']:.1f} messages/s, peak RSS {results['peak_rss_mb']:.0f} MB, "
+                f"{results['forwarded_messages']} forwarded in {results['forward_requests']} requests.")
+    for stage, latency in results["latency"].items():
+        logger.info(f"{stage:>12}: p50 {latency['p50_ms']:8.2f} ms, p95 {latency['p95_ms']:8.2f} ms, "
+                    f"p99 {latency['p99_ms']:8.2f} ms ({latency['count']} spans)")
+    logger.info(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import zlib
+import asyncio
+import logging
+import argparse
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from bot.config import MainConfig
+from bot.logger import setup_logger
+from bot.metrics import MetricsRegistry
+from bot.preprocess import preprocess_batch
+from bot.dataset import TrainingData
+from bot.corpus import DEFAULT_CORPUS_PATH, load_labelled_texts
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class HashedNgramClassifier:
+    def __init__(self, num_classes: int, num_features: int = 2 ** 18, ngram_range: int = 2):
+        """
+        Initialize a linear softmax classifier over hashed word n-grams.
+
+        :param num_classes: The number of categories.
+        :param num_features: The number of hash buckets, a power of two.
+        :param ngram_range: The longest word n-gram used as a feature.
+        """
+        if num_features & (num_features - 1):
+            raise ValueError(f"The number of features must be a power of two, got {num_features}.")
+        self.num_classes = num_classes
+        self.num_features = num_features
+        self.ngram_range = ngram_range
+        self.weights = np.zeros((num_features, num_classes), dtype=np.float32)
+        self.bias = np.zeros(num_classes, dtype=np.float32)
+
+    def features(self, text: str) -> np.ndarray:
+        """
+        Hashes the word n-grams of a preprocessed text into feature indexes.
+
+        :param text: The preprocessed text.
+        :returns: A sorted array of unique feature indexes.
+        """
+        words = text.split()
+        mask = self.num_features - 1
+        indexes = set()
+        for size in range(1, self.ngram_range + 1):
+            for start in range(len(words) - size + 1):
+                ngram = " ".join(words[start:start + size])
+                indexes.add(zlib.crc32(ngram.encode("utf-8")) & mask)
+        return np.fromiter(sorted(indexes), dtype=np.int64, count=len(indexes))
+
+    def _logits(self, indexes: List[np.ndarray]) -> np.ndarray:
+        """
+        Computes the class scores for already hashed texts. Every text is a
+        binary feature vector normalized to unit length.
+
+        :param indexes: The feature indexes of every text.
+        :returns: An array of shape (number of texts, number of classes).
+        """
+        logits = np.tile(self.bias, (len(indexes), 1))
+        for row, text_indexes in enumerate(indexes):
+            if len(text_indexes):
+                logits[row] += self.weights[text_indexes].sum(axis=0) / np.sqrt(len(text_indexes))
+        return logits
+
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns the class probabilities for preprocessed texts.
+
+        :param texts: The preprocessed texts.
+        :returns: An array of shape (number of texts, number of classes).
+        """
+        return _softmax(self._logits([self.features(text) for text in texts]))
+
+    def predict(self, text: str) -> Tuple[int, float]:
+        """
+        Classifies one preprocessed text.
+
+        :param text: The preprocessed text.
+        :returns: The predicted class index and its probability.
+        """
+        probabilities = self.predict_proba([text])[0]
+        category = int(np.argmax(probabilities))
+        return category, float(probabilities[category])
+
+    def fit(self, texts: List[str], labels: np.ndarray, epochs: int = 10,
+            batch_size: int = 256, learning_rate: float = 0.5, l2: float = 1e-6,
+            seed: int = 0) -> None:
+        """
+        Trains the weights with mini-batch AdaGrad on the cross-entropy loss.
+
+        :param texts: The preprocessed training texts.
+        :param labels: The class index of every text.
+        :param epochs: The number of passes over the training texts.
+        :param batch_size: The number of texts in one update.
+        :param learning_rate: The AdaGrad learning rate.
+        :param l2: The L2 penalty applied to the updated weights.
+        :param seed: The seed for shuffling the texts.
+        """
+        indexes = [self.features(text) for text in texts]
+        targets = np.eye(self.num_classes, dtype=np.float32)[labels]
+        weight_squares = np.full_like(self.weights, 1e-8)
+        bias_squares = np.full_like(self.bias, 1e-8)
+        rng = np.random.default_rng(seed)
+
+        for epoch in range(epochs):
+            loss = 0.0
+            order = rng.permutation(len(texts))
+            for start in range(0, len(texts), batch_size):
+                batch = order[start:start + batch_size]
+                batch_indexes = [indexes[row] for row in batch]
+                probabilities = _softmax(self._logits(batch_indexes))
+                errors = (probabilities - targets[batch]) / len(batch)
+                loss -= float(np.sum(targets[batch] * np.log(probabilities + 1e-12)))
+
+                # Spread the error of every text over its normalized features
+                rows = np.concatenate(batch_indexes)
+                scale = np.concatenate([np.full(len(text_indexes), 1 / np.sqrt(max(len(text_indexes), 1)),
+                                                dtype=np.float32) for text_indexes in batch_indexes])
+                owners = np.repeat(np.arange(len(batch)), [len(text_indexes) for text_indexes in batch_indexes])
+                unique_rows, inverse = np.unique(rows, return_inverse=True)
+                gradient = np.zeros((len(unique_rows), self.num_classes), dtype=np.float32)
+                np.add.at(gradient, inverse, errors[owners] * scale[:, None])
+                gradient += l2 * self.weights[unique_rows]
+
+                weight_squares[unique_rows] += gradient ** 2
+                self.weights[unique_rows] -= learning_rate * gradient / np.sqrt(weight_squares[unique_rows])
+                bias_gradient = errors.sum(axis=0)
+                bias_squares += bias_gradient ** 2
+                self.bias -= learning_rate * bias_gradient / np.sqrt(bias_squares)
+
+            logger.info(f"Epoch {epoch + 1}/{epochs}: loss {loss / len(texts):.4f}")
+
+    def save(self, path: str) -> None:
+        """
+        Saves the model to a compressed numpy archive.
+
+        :param path: The path of the '.npz' file.
+        """
+        np.savez_compressed(path, weights=self.weights, bias=self.bias,
+                            ngram_range=np.array(self.ngram_range))
+        logger.info(f"Fast classifier saved to {path}.")
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramClassifier":
+        """
+        Loads a model saved with save().
+
+        :param path: The path of the '.npz' file.
+        :returns: The loaded classifier.
+        """
+        with np.load(path) as data:
+            num_features, num_classes = data["weights"].shape
+            model = cls(num_classes, num_features, int(data["ngram_range"]))
+            model.weights = data["weights"]
+            model.bias = data["bias"]
+        logger.info(f"Fast classifier loaded from {path}.")
+        return model
+
+class CascadeClassifier:
+    def __init__(self, fast_classifier: HashedNgramClassifier, classifier,
+                 threshold: float = 0.9, metrics: Optional[MetricsRegistry] = None,
+                 executor: Optional[Executor] = None):
+        """
+        Initialize the two-stage classifier. The fast classifier answers when
+        it is confident enough, all other texts go to the main classifier.
+
+        :param fast_classifier: The hashed n-gram classifier.
+        :param classifier: The main classifier with an async classify(text) method.
+        :param threshold: The minimum probability for the fast answer.
+        :param metrics: Registry counting the texts answered by every stage.
+        :param executor: The executor running the fast classifier, so that it
+                         does not block the event loop. None uses the default one.
+        """
+        self.fast_classifier = fast_classifier
+        self.classifier = classifier
+        self.threshold = threshold
+        self.metrics = metrics or MetricsRegistry()
+        self.executor = executor
+
+    async def classify(self, text: str) -> int:
+        """
+        Classifies the text with the cheapest stage that is confident.
+
+        :param text: The preprocessed text to classify.
+        :returns: The predicted class index as an integer.
+        """
+        category, probability = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.fast_classifier.predict, text
+        )
+        if probability >= self.threshold:
+            self.metrics.increment("cascade_fast")
+            return category
+
+        self.metrics.increment("cascade_model")
+        return await self.classifier.classify(text)
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    """Converts class scores to probabilities row by row."""
+    exponents = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exponents / exponents.sum(axis=1, keepdims=True)
+
+def report_thresholds(probabilities: np.ndarray, labels: np.ndarray,
+                      thresholds: Optional[List[float]] = None) -> None:
+    """
+    Logs how many held-out texts the fast classifier would answer at every
+    threshold and how accurate those answers are.
+
+    :param probabilities: The predicted probabilities of the held-out texts.
+    :param labels: The true class indexes of the held-out texts.
+    :param thresholds: The thresholds to report.
+    """
+    thresholds = thresholds or [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98]
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    logger.info(f"Held-out accuracy of the fast classifier: {correct.mean():.2%}")
+    for threshold in thresholds:
+        answered = confidence >= threshold
+        accuracy = correct[answered].mean() if answered.any() else 0.0
+        logger.info(f"Threshold {threshold:.2f}: answers {answered.mean():.1%} of messages "
+                    f"with {accuracy:.2%} accuracy")
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Train the fast first-stage classifier.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with labelled messages.")
+    parser.add_argument('--dataset', default=None,
+                        help="Dataset written by bot.dataset, used instead of the corpus.")
+    parser.add_argument('--output', default=None, help="Output file, 'cascade_model_path' by default.")
+    parser.add_argument('--features', type=int, default=2 ** 18, help="Number of hash buckets.")
+    parser.add_argument('--ngrams', type=int, default=2, help="Longest word n-gram.")
+    parser.add_argument('--epochs', type=int, default=10, help="Passes over the training messages.")
+    parser.add_argument('--holdout', type=float, default=0.1, help="Share of messages held out.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    output = args.output or config.bot_settings.get("cascade_model_path")
+    if not output:
+        parser.error("Set 'cascade_model_path' in the configuration or pass --output.")
+
+    if args.dataset:
+        # The dataset already holds the preprocessed texts
+        data = TrainingData(args.dataset)
+        indexes = data.labelled()
+        texts = [data.text(index) for index in indexes]
+        labels = np.asarray(data.labels[indexes])
+    else:
+        messages = load_labelled_texts(config.categories, args.corpus)
+        texts = preprocess_batch(message["text"] for message in messages)
+        labels = np.array([message["label"] for message in messages])
+
+    # Hold out a random share of the messages to choose the threshold
+    order = np.random.default_rng(0).permutation(len(texts))
+    holdout = order[:int(len(texts) * args.holdout)]
+    train = order[len(holdout):]
+
+    model = HashedNgramClassifier(len(config.categories), args.features, args.ngrams)
+    model.fit([texts[index] for index in train], labels[train], epochs=args.epochs)
+    if len(holdout):
+        report_thresholds(model.predict_proba([texts[index] for index in holdout]), labels[holdout])
+    model.save(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,89 @@
 import os
 import logging
+from typing import List, Tuple
 
+import numpy as np
 import torch
 from transformers import BertForSequenceClassification, AutoTokenizer
 
+from bot.embeddings import normalize
+
 # Setting up logging
 logger = logging.getLogger(__name__)
 
+BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+
+def _forward(model: BertForSequenceClassification, input_ids: torch.Tensor,
+             attention_mask: torch.Tensor, token_type_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Runs the encoder once and computes both the class scores and the mean
+    of the token states, which serves as the sentence embedding.
+
+    :param model: The sequence classification model in evaluation mode.
+    :param input_ids: The token IDs of the padded batch.
+    :param attention_mask: The mask of the real tokens in the batch.
+    :param token_type_ids: The segment IDs of the tokens.
+    :returns: The logits and the (not normalized) sentence embeddings.
+    """
+    outputs = model.bert(input_ids=input_ids, attention_mask=attention_mask,
+                         token_type_ids=token_type_ids)
+    # Dropout is inactive in evaluation mode, so this equals the model's own logits
+    logits = model.classifier(model.dropout(outputs.pooler_output))
+
+    mask = attention_mask.unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+    embeddings = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return logits, embeddings
+
+class _ExportModule(torch.nn.Module):
+    def __init__(self, model: BertForSequenceClassification):
+        """
+        Wraps the model so that the exported graph has both outputs.
+
+        :param model: The sequence classification model.
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return _forward(self.model, input_ids, attention_mask, token_type_ids)
+
 class TextClassifier:
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, backend: str = "torch", threads: int = 0,
+                 interop_threads: int = 0):
         """
         Initialize the TextClassifier by loading the model and tokenizer.
 
         :param model_path: Path to the stored model and tokenizer.
+        :param backend: The inference backend: "torch", "torch_int8" (dynamic
+                        int8 quantization), "onnx" or "onnx_int8" (ONNX Runtime).
+        :param threads: The number of threads running one operation, 0 for
+                        the default of the backend.
+        :param interop_threads: The number of threads running independent
+                                PyTorch operations, 0 for the default.
         """
-        # Determine if a GPU is available, otherwise use CPU
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        logger.info(f"Using device: {self.device}")
-        
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown classifier backend {backend}, expected one of {BACKENDS}.")
+        self.backend = backend
+        self.model_path = model_path
+        self.threads = threads
+
+        # Limit the threads of PyTorch, which otherwise starts one per core
+        # and competes with spaCy and the pipeline for them
+        if threads:
+            torch.set_num_threads(threads)
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError as e:
+                # Only possible before PyTorch runs its first parallel operation
+                logger.warning(f"Could not set the inter-op threads: {e}")
+
+        # Determine if a GPU is available, otherwise use CPU. Quantized and
+        # ONNX backends run on the CPU only
+        use_cuda = backend == "torch" and torch.cuda.is_available()
+        self.device = torch.device("cuda" if use_cuda else "cpu")
+        logger.info(f"Using device: {self.device}, backend: {backend}")
+
         # Load the model and tokenizer
         self._load_model(model_path)
 
@@ -33,14 +99,115 @@ class TextClassifier:
 
         # Load the pre-trained model and tokenizer
         logger.info(f"Loading model and tokenizer from {model_path}")
-        self.model = BertForSequenceClassification.from_pretrained(model_path)
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
 
+        if self.backend in ("onnx", "onnx_int8"):
+            self.model = None
+            self.session = self._load_onnx_session(model_path, self.threads)
+            logger.info("Model and tokenizer successfully loaded.")
+            return
+
+        self.model = BertForSequenceClassification.from_pretrained(model_path)
+        if self.backend == "torch_int8":
+            # Replace the linear layers with dynamically quantized int8 versions
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
         # Move the model to the appropriate device (GPU or CPU)
         self.model.to(self.device)
         self.model.eval()  # Set the model to evaluation mode
         logger.info("Model and tokenizer successfully loaded.")
 
+    def _load_onnx_session(self, model_path: str, threads: int = 0):
+        """
+        Loads the ONNX Runtime session, exporting the model to ONNX and
+        quantizing it first if that has not been done yet.
+
+        :param model_path: Path to the stored model and tokenizer.
+        :param threads: The number of intra-op threads, 0 for the ONNX Runtime default.
+        :returns: An ONNX Runtime inference session.
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The 'onnx' backends require onnxruntime. "
+                              "Install it with: pip install onnxruntime onnx") from None
+
+        onnx_path = os.path.join(model_path, "model.onnx")
+        if not os.path.exists(onnx_path):
+            self._export_onnx(model_path, onnx_path)
+
+        if self.backend == "onnx_int8":
+            quantized_path = os.path.join(model_path, "model.int8.onnx")
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                logger.info(f"Quantizing {onnx_path} to int8.")
+                quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+            onnx_path = quantized_path
+
+        logger.info(f"Loading ONNX model from {onnx_path}")
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._onnx_inputs = [model_input.name for model_input in session.get_inputs()]
+        self._onnx_outputs = [model_output.name for model_output in session.get_outputs()]
+        return session
+
+    def share_memory(self) -> None:
+        """Moves the PyTorch weights to shared memory before they are sent to worker processes."""
+        if self.device.type == "cuda":
+            raise ValueError("Classifier worker processes are only supported on the CPU.")
+        if self.model is not None:
+            self.model.share_memory()
+
+    def __getstate__(self) -> dict:
+        """Leaves out the ONNX Runtime session, which cannot be sent to a worker process."""
+        state = self.__dict__.copy()
+        state.pop("session", None)
+        return state
+
+    def prepare_worker(self, threads: int) -> None:
+        """
+        Prepares the classifier in a worker process. ONNX Runtime sessions
+        are not sent to the workers, so every worker opens its own.
+
+        :param threads: The number of inference threads of the worker.
+        """
+        if self.backend in ("onnx", "onnx_int8"):
+            self.session = self._load_onnx_session(self.model_path, threads)
+
+    def _export_onnx(self, model_path: str, onnx_path: str) -> None:
+        """
+        Exports the PyTorch model to ONNX with dynamic batch and sequence axes.
+        The graph outputs the logits and the sentence embeddings.
+
+        :param model_path: Path to the stored model and tokenizer.
+        :param onnx_path: Path of the exported ONNX file.
+        """
+        logger.info(f"Exporting model from {model_path} to {onnx_path}")
+        model = BertForSequenceClassification.from_pretrained(model_path)
+        model.eval()
+
+        # The inputs follow the order of the arguments of the model's forward()
+        sample = self.tokenizer(["example text"], return_tensors="pt")
+        input_names = ["input_ids", "attention_mask", "token_type_ids"]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        dynamic_axes["embeddings"] = {0: "batch"}
+        with torch.no_grad():
+            torch.onnx.export(
+                _ExportModule(model),
+                tuple(sample[name] for name in input_names),
+                onnx_path,
+                input_names=input_names,
+                output_names=["logits", "embeddings"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                dynamo=False
+            )
+
     def classify_text(self, text: str) -> int:
         """
         Classifies the input text and returns the predicted class index.
@@ -48,21 +215,125 @@ class TextClassifier:
         :param text: The input text to classify.
         :returns: The predicted class index as an integer.
         """
-        # Tokenize the preprocessed text and prepare it for the model
-        inputs = self.tokenizer(
-            text,
-            return_tensors="pt",
-            padding="max_length",
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts: List[str], batch_size: int = 32,
+                       bucket_by_length: bool = True) -> List[int]:
+        """
+        Classifies a list of texts and returns the predicted class indexes in
+        the same order. Each batch is padded only to its longest text.
+
+        :param texts: The input texts to classify.
+        :param batch_size: The maximum number of texts in one forward pass.
+        :param bucket_by_length: Whether to group texts of similar length into
+                                 the same batch to reduce padding.
+        :returns: A list of predicted class indexes.
+        """
+        results = self._run_batches(texts, batch_size, bucket_by_length, embeddings=False)
+        return [category for category, _ in results]
+
+    def classify_with_embeddings_batch(self, texts: List[str], batch_size: int = 32,
+                                       bucket_by_length: bool = True) -> List[Tuple[int, np.ndarray]]:
+        """
+        Classifies a list of texts and returns the class index together with
+        the unit sentence embedding of every text, both from the same
+        forward pass.
+
+        :param texts: The input texts to classify.
+        :param batch_size: The maximum number of texts in one forward pass.
+        :param bucket_by_length: Whether to group texts of similar length into
+                                 the same batch to reduce padding.
+        :returns: A list of (class index, embedding) tuples.
+        """
+        return self._run_batches(texts, batch_size, bucket_by_length, embeddings=True)
+
+    def _run_batches(self, texts: List[str], batch_size: int, bucket_by_length: bool,
+                     embeddings: bool) -> List[Tuple[int, np.ndarray]]:
+        """
+        Splits the texts into batches, runs them and restores the input order.
+
+        :param texts: The input texts to classify.
+        :param batch_size: The maximum number of texts in one forward pass.
+        :param bucket_by_length: Whether to group texts of similar length.
+        :param embeddings: Whether to compute the sentence embeddings.
+        :returns: A list of (class index, embedding or None) tuples.
+        """
+        order = list(range(len(texts)))
+        if bucket_by_length:
+            order.sort(key=lambda index: len(texts[index]))
+
+        results = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            batch = [texts[index] for index in indexes]
+            if embeddings:
+                logits, vectors = self.predict(batch)
+            else:
+                logits, vectors = self.predict_logits(batch), [None] * len(batch)
+
+            # Get the index of the class with the highest score for every text
+            for index, predicted_class, vector in zip(indexes, np.argmax(logits, axis=1).tolist(), vectors):
+                results[index] = (predicted_class, vector)
+
+        return results
+
+    def _tokenize(self, texts: List[str], return_tensors: str):
+        """
+        Tokenizes the batch and pads it to the longest text in the batch.
+
+        :param texts: The input texts.
+        :param return_tensors: "np" or "pt".
+        :returns: The tokenizer output.
+        """
+        return self.tokenizer(
+            texts,
+            return_tensors=return_tensors,
+            padding="longest",
             truncation=True,
             max_length=128
-        ).to(self.device)
+        )
+
+    def predict_logits(self, texts: List[str]) -> np.ndarray:
+        """
+        Runs one forward pass over the texts and returns the class scores.
+
+        :param texts: The input texts, padded together to the longest one.
+        :returns: An array of shape (number of texts, number of classes).
+        """
+        if self.backend in ("onnx", "onnx_int8"):
+            inputs = self._tokenize(texts, "np")
+            feed = {name: inputs[name].astype(np.int64) for name in self._onnx_inputs}
+            return self.session.run(["logits"], feed)[0]
+
+        inputs = self._tokenize(texts, "pt").to(self.device)
 
         # Perform inference without calculating gradients
         with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits = outputs.logits  # Extract logits from the model's output
+            logits = self.model(**inputs).logits  # Extract logits from the model's output
+        return logits.float().cpu().numpy()
+
+    def predict(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Runs one forward pass over the texts and returns the class scores
+        together with the unit sentence embeddings.
 
-            # Get the index of the class with the highest score
-            predicted_class = torch.argmax(logits, dim=1).item()
+        :param texts: The input texts, padded together to the longest one.
+        :returns: The logits of shape (number of texts, number of classes) and
+                  the embeddings of shape (number of texts, hidden size).
+        """
+        if self.backend in ("onnx", "onnx_int8"):
+            if "embeddings" not in self._onnx_outputs:
+                raise RuntimeError("The ONNX model has no embeddings output. Delete the "
+                                   "exported .onnx files so that they are exported again.")
+            inputs = self._tokenize(texts, "np")
+            feed = {name: inputs[name].astype(np.int64) for name in self._onnx_inputs}
+            logits, embeddings = self.session.run(["logits", "embeddings"], feed)
+            return logits, normalize(embeddings)
+
+        inputs = self._tokenize(texts, "pt").to(self.device)
 
-        return predicted_class
+        # Perform inference without calculating gradients
+        with torch.no_grad():
+            logits, embeddings = _forward(self.model, inputs["input_ids"], inputs["attention_mask"],
+                                          inputs["token_type_ids"])
+        return logits.float().cpu().numpy(), normalize(embeddings.float().cpu().numpy())
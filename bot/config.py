@@ -49,6 +49,47 @@ class ConfigWorker:
         logger.info(f"Configuration saved to {self.file_path}")
 
 class MainConfig(ConfigWorker):
+    def __init__(self, file_path: str, create_empty: bool = False):
+        """
+        Initialize the main configuration. Settings written by the autotuner
+        are kept in a separate file next to it, e.g. config.tuned.yaml, and
+        override the bot settings of the main file.
+
+        :param file_path: Path to the configuration file.
+        :param create_empty: Whether to create an empty file if it doesn't exist.
+        """
+        root, extension = os.path.splitext(file_path)
+        self.tuned_path = f"{root}.tuned{extension}"
+        super().__init__(file_path, create_empty)
+
+    def load(self) -> None:
+        """Load the configuration from the YAML file and apply the tuned settings."""
+        super().load()
+        if not os.path.exists(self.tuned_path):
+            return
+
+        with open(self.tuned_path, 'r', encoding='utf-8') as file:
+            tuned = yaml.safe_load(file) or {}
+        self.config.setdefault('bot_settings', {}).update(tuned.get('bot_settings', {}))
+        logger.info(f"Tuned settings loaded from {self.tuned_path}")
+
+    def save_tuned(self, settings: Dict) -> None:
+        """
+        Save tuned bot settings to the separate file, leaving the main
+        configuration file as it was written.
+
+        :param settings: The bot settings to override.
+        """
+        with open(self.tuned_path, 'w', encoding='utf-8') as file:
+            yaml.safe_dump(
+                {'bot_settings': settings},
+                file,
+                default_flow_style=False,
+                allow_unicode=True
+            )
+        self.config.setdefault('bot_settings', {}).update(settings)
+        logger.info(f"Tuned settings saved to {self.tuned_path}")
+
     @property
     def telegram(self) -> Dict:
         """Access the 'telegram' section of the configuration."""
@@ -0,0 +1,82 @@
+import os
+import glob
+import json
+import logging
+from typing import Dict, Iterator, List, Optional
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS_PATH = "data/raw"
+
+def iter_corpus_files(corpus_path: str = DEFAULT_CORPUS_PATH) -> List[str]:
+    """
+    Returns the message files of the corpus in a stable order, both the
+    JSON files and the JSONL files written by the message exporter.
+
+    :param corpus_path: Directory with the '<channel_id>_messages.json(l)' files.
+    :returns: A sorted list of file paths.
+    """
+    files = sorted(glob.glob(os.path.join(corpus_path, "*_messages.json")) +
+                   glob.glob(os.path.join(corpus_path, "*_messages.jsonl")))
+    if not files:
+        raise FileNotFoundError(f"No message files found in {corpus_path}.")
+    return files
+
+def load_messages(file_path: str) -> Iterator[Dict]:
+    """
+    Loads the messages of one corpus file. JSONL files are read one line
+    at a time.
+
+    :param file_path: Path to a '<channel_id>_messages.json(l)' file.
+    :returns: An iterator over message dictionaries.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        if file_path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(file)
+
+def iter_corpus(corpus_path: str = DEFAULT_CORPUS_PATH) -> Iterator[Dict]:
+    """
+    Iterates over all messages of the corpus that have text.
+
+    :param corpus_path: Directory with the '<channel_id>_messages.json(l)' files.
+    :returns: An iterator over message dictionaries.
+    """
+    for file_path in iter_corpus_files(corpus_path):
+        for message in load_messages(file_path):
+            if message.get("text"):
+                yield message
+
+def category_ids(categories: Dict[int, str]) -> Dict[str, int]:
+    """
+    Maps category names from the corpus to the category IDs of the model.
+
+    :param categories: The 'categories' section of the main configuration.
+    :returns: A dictionary with category names as keys and IDs as values.
+    """
+    return {name: int(category) for category, name in categories.items()}
+
+def load_labelled_texts(categories: Dict[int, str], corpus_path: str = DEFAULT_CORPUS_PATH,
+                        limit: Optional[int] = None) -> List[Dict]:
+    """
+    Loads the corpus messages whose category is known to the model.
+
+    :param categories: The 'categories' section of the main configuration.
+    :param corpus_path: Directory with the '<channel_id>_messages.json(l)' files.
+    :param limit: The maximum number of messages to load.
+    :returns: A list of message dictionaries with an added 'label' key.
+    """
+    ids = category_ids(categories)
+    messages = []
+    for message in iter_corpus(corpus_path):
+        if message.get("category") not in ids:
+            continue
+        messages.append({**message, "label": ids[message["category"]]})
+        if limit is not None and len(messages) >= limit:
+            break
+    logger.info(f"Loaded {len(messages)} labelled messages from {corpus_path}.")
+    return messages
@@ -0,0 +1,270 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+from bot.config import MainConfig
+from bot.logger import setup_logger
+from bot.preprocess import preprocess_batch
+from bot.corpus import DEFAULT_CORPUS_PATH, category_ids, iter_corpus_files, load_messages
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET_PATH = "data/processed"
+MANIFEST_FILE = "manifest.json"
+SHARDS_DIR = "shards"
+
+# Bumped whenever the layout of the arrays changes
+FORMAT_VERSION = 1
+
+# The columns stored as one .npy array each; "text" is stored as UTF-8
+# bytes in text.bin with the start of every text in text_offsets.npy
+ARRAY_COLUMNS = ("input_ids", "attention_mask", "labels", "message_ids", "channel_ids", "text_offsets")
+
+class TrainingData:
+    def __init__(self, path: str = DEFAULT_DATASET_PATH):
+        """
+        Opens a dataset written by the conversion tool. All arrays are memory
+        mapped, so nothing is read until it is used.
+
+        :param path: The dataset directory.
+        """
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as file:
+            self.manifest = json.load(file)
+
+        self.input_ids = self._load(path, "input_ids")
+        self.attention_mask = self._load(path, "attention_mask")
+        self.labels = self._load(path, "labels")
+        self.message_ids = self._load(path, "message_ids")
+        self.channel_ids = self._load(path, "channel_ids")
+        self._text_offsets = self._load(path, "text_offsets")
+        self._text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode='r') \
+            if self._text_offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @staticmethod
+    def _load(path: str, column: str) -> np.ndarray:
+        return np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+
+    def text(self, index: int) -> str:
+        """
+        Returns the preprocessed text of a message.
+
+        :param index: The index of the message.
+        :returns: The preprocessed text.
+        """
+        start, end = self._text_offsets[index], self._text_offsets[index + 1]
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    def labelled(self) -> np.ndarray:
+        """
+        Returns the indexes of the messages whose category is known to the model.
+
+        :returns: An array of indexes.
+        """
+        return np.flatnonzero(np.asarray(self.labels) >= 0)
+
+def file_digest(file_path: str) -> str:
+    """
+    Returns the SHA-1 digest of a file's contents.
+
+    :param file_path: Path to the file.
+    :returns: The hex digest.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def convert_file(file_path: str, tokenizer, ids: Dict[str, int], max_length: int) -> Dict[str, np.ndarray]:
+    """
+    Preprocesses and tokenizes the messages of one corpus file.
+
+    :param file_path: Path to a '<channel_id>_messages.json(l)' file.
+    :param tokenizer: The tokenizer of the classification model.
+    :param ids: Category IDs by category name.
+    :param max_length: The number of tokens every text is truncated or padded to.
+    :returns: The columns of the file by name.
+    """
+    messages = [message for message in load_messages(file_path) if message.get("text")]
+    texts = preprocess_batch(message["text"] for message in messages)
+    encoded = tokenizer(texts, padding="max_length", truncation=True, max_length=max_length,
+                        return_tensors="np") if texts else None
+
+    encoded_texts = [text.encode("utf-8") for text in texts]
+    return {
+        "input_ids": encoded["input_ids"].astype(np.int32) if texts else np.zeros((0, max_length), np.int32),
+        "attention_mask": encoded["attention_mask"].astype(np.int8) if texts else np.zeros((0, max_length), np.int8),
+        # Messages without a known category keep the label -1
+        "labels": np.array([ids.get(message.get("category"), -1) for message in messages], dtype=np.int64),
+        "message_ids": np.array([message["message_id"] for message in messages], dtype=np.int64),
+        "channel_ids": np.array([message.get("sender_id") or 0 for message in messages], dtype=np.int64),
+        "text_offsets": np.cumsum([0] + [len(text) for text in encoded_texts], dtype=np.int64),
+        "text": np.frombuffer(b"".join(encoded_texts), dtype=np.uint8)
+    }
+
+def save_shard(shard_path: str, columns: Dict[str, np.ndarray]) -> None:
+    """
+    Writes the columns of one corpus file.
+
+    :param shard_path: The directory of the shard.
+    :param columns: The columns by name.
+    """
+    os.makedirs(shard_path, exist_ok=True)
+    for column in ARRAY_COLUMNS:
+        np.save(os.path.join(shard_path, f"{column}.npy"), columns[column])
+    columns["text"].tofile(os.path.join(shard_path, "text.bin"))
+
+def merge_shards(output_path: str, shard_paths: List[str]) -> int:
+    """
+    Concatenates the shards into the dataset arrays, one shard at a time.
+    The arrays are written under temporary names and then replace the old
+    ones.
+
+    :param output_path: The dataset directory.
+    :param shard_paths: The shard directories in dataset order.
+    :returns: The number of messages.
+    """
+    shards = [{column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+               for column in ARRAY_COLUMNS} for path in shard_paths]
+    total = sum(len(shard["labels"]) for shard in shards)
+
+    for column in ARRAY_COLUMNS:
+        if column == "text_offsets":
+            continue
+        first = shards[0][column] if shards else np.zeros(0, np.int64)
+        merged = np.lib.format.open_memmap(os.path.join(output_path, f"{column}.tmp.npy"), mode='w+',
+                                           dtype=first.dtype, shape=(total,) + first.shape[1:])
+        position = 0
+        for shard in shards:
+            merged[position:position + len(shard[column])] = shard[column]
+            position += len(shard[column])
+        merged.flush()
+        del merged
+
+    # Text offsets continue from the end of the previous shard's text
+    offsets, text_end = [np.zeros(1, dtype=np.int64)], 0
+    with open(os.path.join(output_path, "text.tmp.bin"), 'wb') as text_file:
+        for path, shard in zip(shard_paths, shards):
+            offsets.append(shard["text_offsets"][1:] + text_end)
+            text_end += int(shard["text_offsets"][-1])
+            with open(os.path.join(path, "text.bin"), 'rb') as shard_text:
+                shutil.copyfileobj(shard_text, text_file)
+    np.save(os.path.join(output_path, "text_offsets.tmp.npy"), np.concatenate(offsets))
+
+    for column in ARRAY_COLUMNS:
+        os.replace(os.path.join(output_path, f"{column}.tmp.npy"), os.path.join(output_path, f"{column}.npy"))
+    os.replace(os.path.join(output_path, "text.tmp.bin"), os.path.join(output_path, "text.bin"))
+    return total
+
+def shard_name(name: str) -> str:
+    """
+    Returns the name of the shard directory of a corpus file. The extension
+    is kept, so '<id>_messages.json' and '<id>_messages.jsonl' get separate shards.
+
+    :param name: The file name of the corpus file.
+    :returns: The name of the shard directory.
+    """
+    return name.replace(".", "_")
+
+def convert(corpus_path: str, output_path: str, model_path: str, categories: Dict[int, str],
+            max_length: int = 128, force: bool = False) -> Dict:
+    """
+    Converts the corpus into the dataset, reprocessing only the files that
+    are new or changed since the last conversion.
+
+    :param corpus_path: Directory with the '<channel_id>_messages.json(l)' files.
+    :param output_path: The dataset directory.
+    :param model_path: Path to the model whose tokenizer is used.
+    :param categories: The 'categories' section of the main configuration.
+    :param max_length: The number of tokens every text is truncated or padded to.
+    :param force: Whether to reprocess all files.
+    :returns: The new manifest.
+    """
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+
+    # A different tokenizer, length or category mapping invalidates every shard
+    settings = {"version": FORMAT_VERSION, "tokenizer": os.path.abspath(model_path),
+                "max_length": max_length, "categories": {str(k): v for k, v in categories.items()}}
+    known_files = manifest.get("files", {})
+    if force or any(manifest.get(key) != value for key, value in settings.items()):
+        known_files = {}
+
+    tokenizer = None
+    ids = category_ids(categories)
+    files, shard_paths, converted = {}, [], False
+    for file_path in iter_corpus_files(corpus_path):
+        name = os.path.basename(file_path)
+        shard_path = os.path.join(output_path, SHARDS_DIR, shard_name(name))
+        digest = file_digest(file_path)
+
+        if known_files.get(name, {}).get("digest") != digest or not os.path.isdir(shard_path):
+            if tokenizer is None:
+                # The tokenizer is only loaded when a file has to be processed
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_path)
+            columns = convert_file(file_path, tokenizer, ids, max_length)
+            save_shard(shard_path, columns)
+            converted = True
+            files[name] = {"digest": digest, "count": len(columns["labels"])}
+            logger.info(f"Converted {files[name]['count']} messages from {name}.")
+        else:
+            files[name] = known_files[name]
+        shard_paths.append(shard_path)
+
+    # Shards of files that were removed from the corpus are deleted, together
+    # with shards named without the extension by earlier versions, which
+    # are converted again above since their directory does not exist
+    for name in set(manifest.get("files", {})) - set(files):
+        logger.info(f"Removed {name}, which is no longer in the corpus.")
+    shards_dir = os.path.join(output_path, SHARDS_DIR)
+    current = {os.path.basename(path) for path in shard_paths}
+    for name in os.listdir(shards_dir) if os.path.isdir(shards_dir) else []:
+        if name not in current:
+            shutil.rmtree(os.path.join(shards_dir, name), ignore_errors=True)
+
+    if not converted and files == manifest.get("files") and all(manifest.get(key) == value for key, value in settings.items()):
+        logger.info(f"Dataset in {output_path} is up to date ({manifest['count']} messages).")
+        return manifest
+
+    count = merge_shards(output_path, shard_paths)
+    manifest = {**settings, "count": count, "files": files}
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    logger.info(f"Wrote {count} messages from {len(files)} files to {output_path}.")
+    return manifest
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Convert the corpus into memory-mappable training arrays.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with messages.")
+    parser.add_argument('--output', default=DEFAULT_DATASET_PATH, help="Dataset directory.")
+    parser.add_argument('--max-length', type=int, default=128, help="Tokens per text.")
+    parser.add_argument('--force', action='store_true', help="Reprocess all files.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    os.makedirs(args.output, exist_ok=True)
+    convert(args.corpus, args.output, config.bot_settings.get("model_path"), config.categories,
+            args.max_length, args.force)
+
+
+if __name__ == "__main__":
+    main()
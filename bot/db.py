@@ -1,99 +1,399 @@
 import logging
 import datetime
-from typing import List, Set
+import threading
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
 
 import duckdb
 
 # Setting up logging
 logger = logging.getLogger(__name__)
 
+# Messages are stored in one table per hour, named after the hour they cover
+BUCKET_PREFIX = "messages_"
+BUCKET_FORMAT = "%Y%m%d%H"
+
+def bucket_name(date: datetime.datetime) -> str:
+    """
+    Returns the name of the hourly table that stores messages from the date.
+
+    :param date: Timestamp when the message was published.
+    :returns: The name of the hourly table.
+    """
+    # DuckDB stores timestamps with time zone in local time
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return BUCKET_PREFIX + date.strftime(BUCKET_FORMAT)
+
+def bucket_start(name: str) -> datetime.datetime:
+    """
+    Returns the start of the hour covered by the hourly table.
+
+    :param name: The name of the hourly table.
+    :returns: The start of the hour.
+    """
+    return datetime.datetime.strptime(name[len(BUCKET_PREFIX):], BUCKET_FORMAT)
+
 class DuckDBHandler:
     def __init__(self, db_file: str = ':memory:'):
         """
-        Initializes the DuckDB connection and creates the messages table.
+        Initializes the DuckDB connection and prepares the hourly message tables.
 
         :param db_file: Path to the database file. Default database is in-memory.
         """
         self.db = duckdb.connect(db_file)
+        # The connection is shared by the pipeline workers and the cleanup job
+        self.lock = threading.Lock()
+        self.buckets: Set[str] = set()
         self.create_table()
         logger.info(f"Database connected: {db_file}")
 
     def create_table(self):
-        """Creates the 'messages' table if it does not exist."""
-        self.db.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            message_id BIGINT,
-            channel_id BIGINT,
-            grouped_id BIGINT,
-            text TEXT,
-            lemma TEXT[],
-            date TIMESTAMP
-        );
-        ''')
-        logger.info("Table 'messages' is ready.")
-
-    def insert_message(self, message_id: int, channel_id: int, grouped_id: int, 
-                       text: str, lemma: List[str], date: datetime.datetime) -> None:
-        """
-        Inserts a new message into the 'messages' table.
-        
-        :param message_id: Unique identifier for the message.
-        :param channel_id: Channel where the message was posted.
-        :param grouped_id: Group identifier from messages
-        :param text: Text content of the message.
-        :param lemma: A set of lemmatized tokens.
-        :param date: Timestamp when the message was published
-        """
-        self.db.execute('''
-        INSERT INTO messages (message_id, channel_id, grouped_id, text, lemma, date)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (message_id, channel_id, grouped_id, text, lemma, date))
-        logger.info(f"Inserted message {message_id} into database.")
+        """
+        Creates the lemma vocabulary, the pending forwards, the channel
+        progress and the result cache, loads the existing hourly message tables and migrates
+        messages stored by older versions.
+        """
+        with self.lock:
+            self.db.execute('''
+            CREATE TABLE IF NOT EXISTS lemma_vocabulary (
+                id INTEGER,
+                lemma TEXT
+            );
+            ''')
+            self.db.execute('''
+            CREATE TABLE IF NOT EXISTS pending_forwards (
+                channel_id BIGINT,
+                message_id BIGINT,
+                topic_id BIGINT,
+                queued_at TIMESTAMP
+            );
+            ''')
+            self.db.execute('''
+            CREATE TABLE IF NOT EXISTS channel_progress (
+                channel_id BIGINT PRIMARY KEY,
+                last_message_id BIGINT
+            );
+            ''')
+            self.db.execute('''
+            CREATE TABLE IF NOT EXISTS result_cache (
+                text_hash TEXT PRIMARY KEY,
+                lemmas TEXT[],
+                category INTEGER,
+                embedding FLOAT[],
+                created_at TIMESTAMP
+            );
+            ''')
+            self._load_buckets()
+            self._migrate_text_lemmas()
+            self._add_embedding_column()
+        logger.info(f"Hourly message tables are ready ({len(self.buckets)} found).")
+
+    def _migrate_text_lemmas(self) -> None:
+        """
+        Moves messages whose lemmas are stored as text, either in the old 
+        single 'messages' table or in hourly tables, into hourly tables with 
+        interned lemma IDs. Must be called with the lock held.
+        """
+        tables = [name for (name,) in self.db.execute('''
+        SELECT table_name FROM information_schema.columns
+        WHERE table_schema = 'main' AND column_name = 'lemma'
+          AND (table_name = 'messages' OR starts_with(table_name, ?))
+        ''', (BUCKET_PREFIX,)).fetchall()]
+        if not tables:
+            return
+
+        logger.info(f"Migrating {len(tables)} table(s) to interned lemma IDs.")
+        vocabulary = dict(self.db.execute("SELECT lemma, id FROM lemma_vocabulary").fetchall())
+        new_lemmas = []
+        by_bucket: Dict[str, List[Tuple]] = defaultdict(list)
+
+        self.db.execute("BEGIN TRANSACTION")
+        try:
+            for table in tables:
+                rows = self.db.execute(f'''
+                SELECT message_id, channel_id, grouped_id, text, lemma, date FROM {table}
+                WHERE date IS NOT NULL
+                ''').fetchall()
+                for message_id, channel_id, grouped_id, text, lemma, date in rows:
+                    lemma_ids = set()
+                    for word in lemma or []:
+                        if word not in vocabulary:
+                            vocabulary[word] = len(vocabulary)
+                            new_lemmas.append((vocabulary[word], word))
+                        lemma_ids.add(vocabulary[word])
+                    by_bucket[bucket_name(date)].append((message_id, channel_id, grouped_id, 
+                                                         text, sorted(lemma_ids), date))
+                self.db.execute(f"DROP TABLE {table}")
+                self.buckets.discard(table)
+
+            if new_lemmas:
+                self.db.executemany("INSERT INTO lemma_vocabulary (id, lemma) VALUES (?, ?)", 
+                                    new_lemmas)
+            for name, rows in by_bucket.items():
+                self._create_bucket(name)
+                self.db.executemany(f'''
+                INSERT INTO {name} (message_id, channel_id, grouped_id, text, lemma_ids, date)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+        except Exception:
+            self.db.execute("ROLLBACK")
+            self._load_buckets()
+            raise
+        self.db.execute("COMMIT")
+        logger.info(f"Migrated {sum(map(len, by_bucket.values()))} messages "
+                    f"and {len(new_lemmas)} new lemmas.")
+
+    def _add_embedding_column(self) -> None:
+        """
+        Adds the embedding column to hourly tables created by older versions.
+        Must be called with the lock held.
+        """
+        with_column = {name for (name,) in self.db.execute('''
+        SELECT table_name FROM information_schema.columns
+        WHERE table_schema = 'main' AND column_name = 'embedding'
+          AND starts_with(table_name, ?)
+        ''', (BUCKET_PREFIX,)).fetchall()}
+        for name in self.buckets - with_column:
+            self.db.execute(f"ALTER TABLE {name} ADD COLUMN embedding FLOAT[]")
+
+    def _load_buckets(self) -> None:
+        """Reloads the names of the hourly tables. Must be called with the lock held."""
+        self.buckets = {name for (name,) in self.db.execute('''
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'main' AND starts_with(table_name, ?)
+        ''', (BUCKET_PREFIX,)).fetchall()}
+
+    def _create_bucket(self, name: str) -> str:
+        """
+        Creates the hourly table if it does not exist. Must be called with
+        the lock held.
+
+        :param name: The name of the hourly table.
+        :returns: The name of the hourly table.
+        """
+        if name not in self.buckets:
+            self.db.execute(f'''
+            CREATE TABLE IF NOT EXISTS {name} (
+                message_id BIGINT,
+                channel_id BIGINT,
+                grouped_id BIGINT,
+                text TEXT,
+                lemma_ids INTEGER[],
+                date TIMESTAMP,
+                embedding FLOAT[]
+            );
+            ''')
+            self.buckets.add(name)
+        return name
+
+    def _live_buckets(self, time_threshold: datetime.datetime) -> List[str]:
+        """
+        Returns the hourly tables that may contain messages newer than the
+        threshold. Must be called with the lock held.
+
+        :param time_threshold: The oldest date of interest.
+        :returns: A list of hourly table names.
+        """
+        return sorted(name for name in self.buckets
+                      if bucket_start(name) + datetime.timedelta(hours=1) > time_threshold)
+
+    def _select_live(self, columns: str, condition: str, params: Tuple,
+                     time_threshold: datetime.datetime) -> List[Tuple]:
+        """
+        Runs the same select over all live hourly tables. Must be called with
+        the lock held.
+
+        :param columns: The columns to select.
+        :param condition: The WHERE condition applied to every table.
+        :param params: The parameters of the condition.
+        :param time_threshold: The oldest date of interest.
+        :returns: The selected rows.
+        """
+        buckets = self._live_buckets(time_threshold)
+        if not buckets:
+            return []
+
+        query = " UNION ALL ".join(f"SELECT {columns} FROM {name} WHERE {condition}"
+                                   for name in buckets)
+        return self.db.execute(query, params * len(buckets)).fetchall()
+
+    def insert_messages(self, messages: List[Tuple]) -> None:
+        """
+        Inserts several messages into the hourly tables in one transaction.
+
+        :param messages: A list of (message_id, channel_id, grouped_id, text,
+                         lemma_ids, date, embedding) tuples.
+        """
+        by_bucket: Dict[str, List[Tuple]] = defaultdict(list)
+        for message in messages:
+            by_bucket[bucket_name(message[5])].append(message)
+
+        with self.lock:
+            self.db.execute("BEGIN TRANSACTION")
+            try:
+                for name, rows in by_bucket.items():
+                    self._create_bucket(name)
+                    self.db.executemany(f'''
+                    INSERT INTO {name} (message_id, channel_id, grouped_id, text, lemma_ids, date, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+            except Exception:
+                self.db.execute("ROLLBACK")
+                # Tables created in the transaction are gone after the rollback
+                self._load_buckets()
+                raise
+            self.db.execute("COMMIT")
+        logger.info(f"Inserted {len(messages)} messages into database.")
 
     def cleanup_old_messages(self, time_frame: int = 1) -> None:
         """
-        Removes messages older than the specified time frame (in hours).
-        
+        Drops the hourly tables that only hold messages older than the
+        specified time frame (in hours).
+
         :param time_frame: The number of hours to retain messages. Default is 1 hour.
         """
         time_threshold = datetime.datetime.now() - datetime.timedelta(hours=time_frame)
-        self.db.execute('''
-        DELETE FROM messages WHERE date < ?
-        ''', (time_threshold,))
-        logger.info(f"Cleaned up messages older than {time_frame} hour(s).")
+        with self.lock:
+            expired = self.buckets - set(self._live_buckets(time_threshold))
+            for name in expired:
+                self.db.execute(f"DROP TABLE IF EXISTS {name}")
+            self.buckets -= expired
+        logger.info(f"Cleaned up messages older than {time_frame} hour(s) "
+                    f"({len(expired)} hourly table(s) dropped).")
 
-    def get_recent_messages_lemmas(self, time_frame: int = 1) -> List[Set[str]]:
+    def get_recent_messages(self, time_frame: int = 1) -> List[Tuple]:
         """
-        Retrieves the lemmatized tokens from messages created within the last 
-        time frame (in hours).
-        
+        Retrieves the keys, lemma IDs, dates and embeddings of messages
+        created within the last time frame (in hours).
+
         :param time_frame: The number of hours to consider for message retrieval. Default is 1 hour.
-        :returns: A list of sets of lemmatized tokens from the recent messages.
+        :returns: A list of (message_id, channel_id, grouped_id, lemma_ids, date,
+                  embedding) tuples.
         """
         time_threshold = datetime.datetime.now() - datetime.timedelta(hours=time_frame)
-        return [set(x[0]) for x in self.db.execute('''
-        SELECT lemma FROM messages WHERE date >= ?
-        ''', (time_threshold,)).fetchall()]
-    
-    def check_message_exists(self, message_id: int, channel_id: int, 
-                             grouped_id: int) -> bool:
-        """
-        Checks whether a message with the given message_id, channel_id, 
-        or grouped_id exists in the database.
-        
-        :param message_id: The unique ID of the message.
-        :param channel_id: The ID of the channel where the message was posted.
-        :param grouped_id: Group identifier from messages
-        :return: True if the message exists, False otherwise.
-        """
-        result = self.db.execute('''
-        SELECT COUNT(*) FROM messages WHERE channel_id = ? AND (message_id = ? OR grouped_id = ?)
-        ''', (channel_id, message_id, grouped_id)).fetchone()
-        return result[0] > 0 # True if message exists, False otherwise
+        with self.lock:
+            return self._select_live("message_id, channel_id, grouped_id, lemma_ids, date, embedding",
+                                     "date >= ?", (time_threshold,), time_threshold)
+
+    def get_lemma_vocabulary(self) -> List[Tuple[str, int]]:
+        """
+        Retrieves the lemma vocabulary.
+
+        :returns: A list of (lemma, id) tuples.
+        """
+        with self.lock:
+            return self.db.execute("SELECT lemma, id FROM lemma_vocabulary").fetchall()
+
+    def insert_lemmas(self, lemmas: List[Tuple[int, str]]) -> None:
+        """
+        Adds new lemmas to the lemma vocabulary.
+
+        :param lemmas: A list of (id, lemma) tuples.
+        """
+        with self.lock:
+            self.db.executemany("INSERT INTO lemma_vocabulary (id, lemma) VALUES (?, ?)", lemmas)
+        logger.info(f"Added {len(lemmas)} lemmas to the vocabulary.")
+
+    def insert_pending_forwards(self, forwards: List[Tuple]) -> None:
+        """
+        Stores messages that are waiting to be forwarded.
+
+        :param forwards: A list of (channel_id, message_id, topic_id, queued_at) tuples.
+        """
+        with self.lock:
+            self.db.executemany('''
+            INSERT INTO pending_forwards (channel_id, message_id, topic_id, queued_at)
+            VALUES (?, ?, ?, ?)
+            ''', forwards)
+
+    def delete_pending_forwards(self, channel_id: int, message_ids: List[int]) -> None:
+        """
+        Removes messages that have been forwarded or given up on.
+
+        :param channel_id: The channel where the messages were posted.
+        :param message_ids: The IDs of the messages.
+        """
+        with self.lock:
+            self.db.execute('''
+            DELETE FROM pending_forwards WHERE channel_id = ? AND list_contains(?, message_id)
+            ''', (channel_id, message_ids))
+
+    def get_pending_forwards(self) -> List[Tuple]:
+        """
+        Retrieves the messages that are still waiting to be forwarded, oldest first.
+
+        :returns: A list of (channel_id, message_id, topic_id, queued_at) tuples.
+        """
+        with self.lock:
+            return self.db.execute('''
+            SELECT channel_id, message_id, topic_id, queued_at FROM pending_forwards
+            ORDER BY queued_at, message_id
+            ''').fetchall()
+
+    def get_channel_progress(self) -> Dict[int, int]:
+        """
+        Retrieves the ID of the last processed message of every channel.
+
+        :returns: A dictionary with channel IDs as keys and message IDs as values.
+        """
+        with self.lock:
+            return dict(self.db.execute(
+                "SELECT channel_id, last_message_id FROM channel_progress"
+            ).fetchall())
+
+    def update_channel_progress(self, progress: Dict[int, int]) -> None:
+        """
+        Stores the ID of the last processed message of the given channels.
+
+        :param progress: A dictionary with channel IDs as keys and message IDs as values.
+        """
+        with self.lock:
+            self.db.executemany('''
+            INSERT OR REPLACE INTO channel_progress (channel_id, last_message_id) VALUES (?, ?)
+            ''', list(progress.items()))
+
+    def get_cached_results(self, since: datetime.datetime, limit: int) -> List[Tuple]:
+        """
+        Retrieves the newest cached lemmatization and classification results.
+
+        :param since: The oldest creation time of interest.
+        :param limit: The maximum number of results.
+        :returns: A list of (text_hash, lemmas, category, embedding, created_at)
+                  tuples, newest first.
+        """
+        with self.lock:
+            return self.db.execute('''
+            SELECT text_hash, lemmas, category, embedding, created_at FROM result_cache
+            WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?
+            ''', (since, limit)).fetchall()
+
+    def upsert_cached_results(self, results: List[Tuple]) -> None:
+        """
+        Stores cached results, replacing the stored results of the same texts.
+
+        :param results: A list of (text_hash, lemmas, category, embedding,
+                        created_at) tuples.
+        """
+        with self.lock:
+            self.db.executemany('''
+            INSERT OR REPLACE INTO result_cache (text_hash, lemmas, category, embedding, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', results)
+
+    def delete_cached_results(self, before: datetime.datetime) -> None:
+        """
+        Removes cached results created before the given time.
+
+        :param before: The creation time before which results are removed.
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM result_cache WHERE created_at < ?", (before,))
 
     def close(self) -> None:
         """
         Closes the database connection.
         """
         logger.info("Closing the database connection.")
-        self.db.close()
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,328 @@
+import time
+import json
+import socket
+import asyncio
+import hashlib
+import logging
+import argparse
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Set, Tuple
+
+import numpy as np
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from bot.db import DuckDBHandler
+from bot.config import MainConfig
+from bot.logger import setup_logger
+from bot.forwarding import TokenBucket
+from bot.message_window import MessageWindow, create_message_window
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+def shard_of(channel_id: int, shards: int) -> int:
+    """
+    Returns the shard that processes the messages of a channel.
+
+    :param channel_id: The ID of the channel.
+    :param shards: The number of shards.
+    :returns: The index of the shard, from 0 to shards - 1.
+    """
+    digest = hashlib.blake2b(str(channel_id).encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+def parse_address(address: str) -> Tuple[str, Optional[int]]:
+    """
+    Splits the address of the dedup server.
+
+    :param address: "host:port" for TCP or "unix:/path/to/socket" for a Unix socket.
+    :returns: The host and port, or the socket path and None.
+    """
+    if address.startswith("unix:"):
+        return address[len("unix:"):], None
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+class DedupServer:
+    def __init__(self, window: MessageWindow, limiter: TokenBucket):
+        """
+        Initializes the service that owns the message window and the
+        forwarding rate limit shared by all shards. Every request is one JSON
+        line with the operation and its arguments, and every response is one
+        JSON line with the result or the error.
+
+        :param window: The window of recent messages of all shards.
+        :param limiter: The rate limit of the forward requests of all shards.
+        """
+        self.window = window
+        self.limiter = limiter
+
+    async def serve(self, address: str) -> None:
+        """
+        Accepts connections from the shards until cancelled.
+
+        :param address: "host:port" or "unix:/path/to/socket".
+        """
+        host, port = parse_address(address)
+        if port is None:
+            server = await asyncio.start_unix_server(self._handle, path=host)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        logger.info(f"Dedup server listening on {address} with {len(self.window)} recent message(s).")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the requests of one connection in order."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = {"result": await self._dispatch(request["op"], request.get("args", []))}
+                except Exception as e:
+                    logger.error(f"Failed to answer a dedup request: {e}")
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, op: str, args: list) -> Any:
+        """
+        Runs one operation of a request.
+
+        :param op: The name of the operation.
+        :param args: The JSON-decoded arguments.
+        :returns: The JSON-serializable result.
+        """
+        loop = asyncio.get_running_loop()
+        if op == "add_if_new":
+            message_id, channel_id, grouped_id, text, lemmas, date, embedding = args
+            return await loop.run_in_executor(
+                None, self.window.add_if_new, message_id, channel_id, grouped_id, text,
+                set(lemmas), datetime.datetime.fromisoformat(date),
+                np.array(embedding, dtype=np.float32) if embedding is not None else None
+            )
+        if op == "contains":
+            return await loop.run_in_executor(None, self.window.contains, *args)
+        if op == "forward_token":
+            await self.limiter.acquire()
+            return True
+        raise ValueError(f"Unknown operation {op}.")
+
+    async def flush_periodically(self, interval: float) -> None:
+        """
+        Writes the new messages of the window to the database until cancelled.
+
+        :param interval: The time in seconds between flushes.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.window.flush)
+            except Exception as e:
+                logger.error(f"Failed to flush messages to the database: {e}")
+
+class DedupClient:
+    def __init__(self, address: str, timeout: float = 60):
+        """
+        Initializes the client of the dedup server. Every thread uses its own
+        connection, which is opened on the first request.
+
+        :param address: "host:port" or "unix:/path/to/socket".
+        :param timeout: The time in seconds to wait for a response.
+        """
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        host, port = parse_address(self.address)
+        if port is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(host)
+        else:
+            connection = socket.create_connection((host, port), timeout=self.timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection.makefile("rwb")
+
+    def call(self, op: str, *args: Any) -> Any:
+        """
+        Sends a request to the dedup server and waits for its response.
+
+        :param op: The name of the operation.
+        :param args: The JSON-serializable arguments.
+        :returns: The result of the operation.
+        """
+        stream = getattr(self._local, "stream", None)
+        try:
+            if stream is None:
+                stream = self._local.stream = self._connect()
+            stream.write(json.dumps({"op": op, "args": args}, ensure_ascii=False).encode("utf-8") + b"\n")
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise ConnectionError("the dedup server closed the connection")
+        except OSError:
+            # The next request opens a new connection
+            self._local.stream = None
+            if stream is not None:
+                stream.close()
+            raise
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Dedup server failed: {response['error']}")
+        return response["result"]
+
+class RemoteMessageWindow:
+    def __init__(self, client: DedupClient, message_lifetime: int):
+        """
+        Initializes the message window of a shard, which checks and stores
+        messages in the window of the dedup server. A channel belongs to one
+        shard only, so the messages accepted by this shard are remembered
+        locally to skip repeated events without a request.
+
+        :param client: The client of the dedup server.
+        :param message_lifetime: The time in hours messages stay in the window.
+        """
+        self.client = client
+        self.message_lifetime = message_lifetime
+        self.lock = threading.Lock()
+        self._keys: "OrderedDict[Tuple[int, int, bool], float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def load(self) -> None:
+        """The messages are kept by the dedup server, so nothing is loaded."""
+
+    def flush(self) -> None:
+        """The messages are written by the dedup server, so nothing is flushed."""
+
+    def contains(self, message_id: int, channel_id: int, grouped_id: Optional[int]) -> bool:
+        """
+        Checks whether the message or another message of its group is in the
+        window. Messages this shard accepted are found without a request,
+        others, e.g. accepted before a restart, are looked up on the server.
+
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel where the message was posted.
+        :param grouped_id: Group identifier from messages.
+        :returns: True if the message is known, False otherwise.
+        """
+        with self.lock:
+            if (channel_id, message_id, False) in self._keys or \
+               (grouped_id is not None and (channel_id, grouped_id, True) in self._keys):
+                return True
+        return self.client.call("contains", message_id, channel_id, grouped_id)
+
+    def add_if_new(self, message_id: int, channel_id: int, grouped_id: Optional[int],
+                   text: str, lemmas: Set[str], date: datetime.datetime,
+                   embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        """
+        Adds the message to the window of the dedup server unless it is a
+        duplicate or similar to a recent message of any shard.
+
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel where the message was posted.
+        :param grouped_id: Group identifier from messages.
+        :param text: The preprocessed text of the message.
+        :param lemmas: The set of lemmatized tokens of the message.
+        :param date: Timestamp when the message was published.
+        :param embedding: The unit sentence embedding of the message.
+        :returns: "duplicate" or "similar" if the message was rejected,
+                  otherwise None.
+        """
+        skip_reason = self.client.call(
+            "add_if_new", message_id, channel_id, grouped_id, text, sorted(lemmas),
+            date.isoformat(), embedding.tolist() if embedding is not None else None
+        )
+        if skip_reason is None:
+            now = time.time()
+            with self.lock:
+                self._keys[(channel_id, message_id, False)] = now
+                if grouped_id is not None:
+                    self._keys[(channel_id, grouped_id, True)] = now
+                # Keys are added in time order, so the expired ones are at the front
+                while self._keys and next(iter(self._keys.values())) < now - self.message_lifetime * 3600:
+                    self._keys.popitem(last=False)
+        return skip_reason
+
+class RemoteTokenBucket:
+    def __init__(self, client: DedupClient):
+        """
+        Initializes the rate limiter of a shard, which takes its tokens from
+        the token bucket of the dedup server shared by all shards.
+
+        :param client: The client of the dedup server.
+        """
+        self.client = client
+
+    async def acquire(self) -> None:
+        """Waits until the dedup server hands out a token."""
+        await asyncio.get_running_loop().run_in_executor(None, self.client.call, "forward_token")
+
+async def serve(config: MainConfig, db_handler: DuckDBHandler, address: str) -> None:
+    """
+    Runs the dedup server with the window stored in the database.
+
+    :param config: Main configuration object with global settings.
+    :param db_handler: Database handler of the shared window.
+    :param address: "host:port" or "unix:/path/to/socket".
+    """
+    server = DedupServer(
+        create_message_window(config, db_handler),
+        TokenBucket(config.bot_settings.get("forward_rate", 1.0),
+                    config.bot_settings.get("forward_burst", 5))
+    )
+    flush = asyncio.create_task(server.flush_periodically(config.bot_settings.get("flush_interval", 5)))
+    try:
+        await server.serve(address)
+    finally:
+        flush.cancel()
+        # Write the messages that are still pending to the database
+        server.window.flush()
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Shared message window of the bot shards.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--address', help="Address to listen on, defaults to dedup_server.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    address = args.address or config.bot_settings.get("dedup_server")
+    if not address:
+        parser.error("Set dedup_server in the configuration or pass --address.")
+
+    # The server owns the database of the window, the shards keep their own
+    db_handler = DuckDBHandler(db_file=config.bot_settings.get("db_path"))
+
+    # Set up a recurring task to drop expired hourly tables from the database
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(db_handler.cleanup_old_messages, 'interval',
+                      minutes=config.bot_settings.get("cleanup_interval", 5),
+                      args=[config.bot_settings.get("message_lifetime")])
+    scheduler.start()
+
+    try:
+        asyncio.run(serve(config, db_handler, address))
+    except KeyboardInterrupt:
+        logger.info("Dedup server stopped.")
+
+
+if __name__ == "__main__":
+    main()
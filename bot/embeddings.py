@@ -0,0 +1,134 @@
+import heapq
+import logging
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scales the vectors to unit length so that dot products are cosine
+    similarities.
+
+    :param vectors: A vector or a matrix with one vector per row.
+    :returns: The float32 unit vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class EmbeddingIndex:
+    def __init__(self, threshold: float = 0.9):
+        """
+        Initializes the near-duplicate index over sentence embeddings. The
+        unit embeddings of all messages are kept in one matrix, so the cosine
+        similarity with the whole window is a single matrix-vector product.
+
+        :param threshold: The cosine similarity above which texts are similar.
+        """
+        self.threshold = threshold
+        self._vectors: Optional[np.ndarray] = None
+        self._alive = np.zeros(64, dtype=np.bool_)
+        self._count = 0
+        self._keys: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._expiry_heap: List[Tuple[float, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, key: Hashable, embedding: Optional[np.ndarray], timestamp: float) -> None:
+        """
+        Adds the embedding of a message to the index.
+
+        :param key: The unique key of the message.
+        :param embedding: The unit embedding of the message.
+        :param timestamp: The POSIX time of the message, used for expiry.
+        """
+        # Messages stored without an embedding are not indexed
+        if embedding is None or len(embedding) == 0 or key in self._positions:
+            return
+
+        if self._vectors is None:
+            self._vectors = np.zeros((64, len(embedding)), dtype=np.float32)
+        elif self._count == len(self._vectors):
+            # Grow geometrically so that appends stay amortized O(1)
+            self._vectors = np.concatenate((self._vectors, np.zeros_like(self._vectors)))
+            self._alive = np.concatenate((self._alive, np.zeros_like(self._alive)))
+
+        self._vectors[self._count] = embedding
+        self._alive[self._count] = True
+        self._positions[key] = self._count
+        self._keys.append(key)
+        self._count += 1
+        heapq.heappush(self._expiry_heap, (timestamp, key))
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Removes a message from the index.
+
+        :param key: The unique key of the message.
+        """
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+
+        self._alive[position] = False
+        # Compact the matrix once most of it is taken by removed messages
+        if len(self._positions) < self._count // 2:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rebuilds the matrix from the messages that are still in the index."""
+        alive = np.flatnonzero(self._alive[:self._count])
+        capacity = max(64, 2 * len(alive))
+
+        vectors = np.zeros((capacity, self._vectors.shape[1]), dtype=np.float32)
+        vectors[:len(alive)] = self._vectors[alive]
+        self._vectors = vectors
+        self._alive = np.zeros(capacity, dtype=np.bool_)
+        self._alive[:len(alive)] = True
+        self._count = len(alive)
+        self._keys = [self._keys[position] for position in alive]
+        self._positions = {key: position for position, key in enumerate(self._keys)}
+
+    def expire(self, before: float) -> int:
+        """
+        Removes all messages older than the given time.
+
+        :param before: The POSIX time before which messages are removed.
+        :returns: The number of removed messages.
+        """
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < before:
+            _, key = heapq.heappop(self._expiry_heap)
+            if key in self._positions:
+                self.remove(key)
+                removed += 1
+        return removed
+
+    def find_similar(self, embedding: Optional[np.ndarray]) -> Optional[Hashable]:
+        """
+        Finds a message whose cosine similarity with the embedding exceeds
+        the threshold.
+
+        :param embedding: The unit embedding of the current message.
+        :returns: The key of a similar message, or None if there is none.
+        """
+        if embedding is None or not self._positions:
+            return None
+
+        similarity = self._vectors[:self._count] @ embedding
+        similar = np.flatnonzero((similarity > self.threshold) & self._alive[:self._count])
+        return self._keys[similar[0]] if len(similar) else None
+
+    def is_similar(self, embedding: Optional[np.ndarray]) -> bool:
+        """
+        Checks if the embedding is similar to any message in the index.
+
+        :param embedding: The unit embedding of the current message.
+        :returns: True if a similar message exists, otherwise False.
+        """
+        return self.find_similar(embedding) is not None
@@ -0,0 +1,255 @@
+import time
+import asyncio
+import logging
+import datetime
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import ForwardMessagesRequest
+
+from bot.db import DuckDBHandler
+from bot.metrics import MetricsRegistry
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most this many message IDs in one forward request
+MAX_FORWARD_IDS = 100
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        """
+        Initialize the token bucket rate limiter.
+
+        :param rate: The number of tokens added per second.
+        :param capacity: The maximum number of tokens, i.e. the burst size.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ForwardingScheduler:
+    def __init__(self, client: TelegramClient, db_handler: DuckDBHandler, forum_id: int,
+                 rate: float = 1.0, burst: int = 5, coalesce_ms: float = 500,
+                 max_retries: int = 5, log_every: int = 100,
+                 metrics: Optional[MetricsRegistry] = None, limiter=None):
+        """
+        Initialize the forwarding scheduler. Accepted messages are stored in
+        the database, merged per source channel and target topic, and
+        forwarded by one background task at a limited request rate.
+
+        :param client: The Telegram client instance.
+        :param db_handler: Database handler storing the pending forwards.
+        :param forum_id: The ID of the forum to forward messages to.
+        :param rate: The maximum number of forward requests per second.
+        :param burst: The number of requests that may be sent at once.
+        :param coalesce_ms: The time in milliseconds to wait for more messages
+                            before sending.
+        :param max_retries: The number of retries after errors other than FloodWait.
+        :param log_every: The number of requests between metric logs.
+        :param metrics: Registry for the duration of the forward requests.
+        :param limiter: Rate limiter shared with other shards, None limits
+                        this scheduler with its own token bucket.
+        """
+        self.client = client
+        self.db_handler = db_handler
+        self.forum_id = forum_id
+        self.limiter = limiter or TokenBucket(rate, burst)
+        self.coalesce_delay = coalesce_ms / 1000
+        self.max_retries = max_retries
+        self.log_every = log_every
+        self.metrics = metrics or MetricsRegistry()
+
+        # Pending message IDs with their queue time, grouped by (channel ID,
+        # topic ID) in the order the groups were created
+        self._pending: "OrderedDict[Tuple[int, int], List[Tuple[int, float]]]" = OrderedDict()
+        # Failed groups with their number of failures and the monotonic time
+        # before which they are not retried
+        self._failures: Dict[Tuple[int, int], int] = {}
+        self._not_before: Dict[Tuple[int, int], float] = {}
+        self._wakeup = asyncio.Event()
+        self._wait_times = deque(maxlen=1000)
+        self.counters: Dict[str, int] = {"requests": 0, "messages": 0, "flood_waits": 0,
+                                         "retries": 0, "dropped": 0}
+
+    def queue_depth(self) -> int:
+        """
+        Returns the number of messages waiting to be forwarded.
+
+        :returns: The number of pending messages.
+        """
+        return sum(len(entries) for entries in self._pending.values())
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the queue depth, the counters and the wait time percentiles
+        of recently forwarded messages.
+
+        :returns: A dictionary with metric names as keys.
+        """
+        waits = np.array(self._wait_times) if self._wait_times else np.zeros(1)
+        return {"queue_depth": self.queue_depth(), **self.counters,
+                "wait_p50": float(np.percentile(waits, 50)),
+                "wait_p95": float(np.percentile(waits, 95)),
+                "wait_max": float(waits.max())}
+
+    async def submit(self, channel_id: int, message_ids: List[int], topic_id: int) -> None:
+        """
+        Stores the messages and queues them for forwarding.
+
+        :param channel_id: The channel where the messages were posted.
+        :param message_ids: The IDs of the messages, e.g. all parts of an album.
+        :param topic_id: The forum topic to forward the messages to.
+        """
+        queued_at = datetime.datetime.now()
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.db_handler.insert_pending_forwards,
+            [(channel_id, message_id, topic_id, queued_at) for message_id in message_ids]
+        )
+        self._add(channel_id, message_ids, topic_id, queued_at.timestamp())
+
+    def _add(self, channel_id: int, message_ids: List[int], topic_id: int, queued_at: float) -> None:
+        """
+        Adds the messages to the in-memory queue and wakes up the sender.
+
+        :param channel_id: The channel where the messages were posted.
+        :param message_ids: The IDs of the messages.
+        :param topic_id: The forum topic to forward the messages to.
+        :param queued_at: The POSIX time the messages were queued.
+        """
+        entries = self._pending.setdefault((channel_id, topic_id), [])
+        entries.extend((message_id, queued_at) for message_id in message_ids)
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Restores the stored forwards and sends queued messages until cancelled."""
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, self.db_handler.get_pending_forwards
+        )
+        for channel_id, message_id, topic_id, queued_at in rows:
+            self._add(channel_id, [message_id], topic_id, queued_at.timestamp())
+        logger.info(f"Forwarding scheduler started with {len(rows)} restored message(s).")
+
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Give other messages of the same channel and topic a moment to arrive
+            await asyncio.sleep(self.coalesce_delay)
+            while self._pending:
+                key = self._next_ready()
+                if key is None:
+                    # Every group waits for a retry, so sleep until the
+                    # earliest one is due or new messages arrive
+                    delay = min(self._not_before.values()) - time.monotonic()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), max(delay, 0))
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                await self.limiter.acquire()
+
+                # Take the oldest ready group; what does not fit into one
+                # request goes to the back so other groups are not starved
+                entries = self._pending.pop(key)
+                if len(entries) > MAX_FORWARD_IDS:
+                    self._pending[key] = entries[MAX_FORWARD_IDS:]
+                    entries = entries[:MAX_FORWARD_IDS]
+                await self._send(key, entries)
+
+    def _next_ready(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the oldest pending group that is not waiting for a retry.
+
+        :returns: The channel ID and topic ID, or None if every group waits.
+        """
+        now = time.monotonic()
+        for key in self._pending:
+            if self._not_before.get(key, 0) <= now:
+                return key
+        return None
+
+    async def _send(self, key: Tuple[int, int], entries: List[Tuple[int, float]]) -> None:
+        """
+        Forwards the messages of one channel to one topic in a single request.
+        FloodWait errors apply to the whole account, so they are waited out
+        here. After other errors the messages go back to the queue and the
+        group is retried with backoff while other groups are forwarded.
+
+        :param key: The channel ID and topic ID.
+        :param entries: The message IDs with their queue time.
+        """
+        channel_id, topic_id = key
+        message_ids = sorted(message_id for message_id, _ in entries)
+        dropped = False
+        while True:
+            try:
+                with self.metrics.timer("forward_request"):
+                    await self.client(ForwardMessagesRequest(
+                        from_peer=channel_id,
+                        id=message_ids,
+                        to_peer=self.forum_id,
+                        top_msg_id=topic_id,
+                    ))
+                break
+            except FloodWaitError as e:
+                self.counters["flood_waits"] += 1
+                logger.warning(f"FloodWait while forwarding, sleeping for {e.seconds}s "
+                               f"with {self.queue_depth() + len(message_ids)} message(s) pending.")
+                await asyncio.sleep(e.seconds + 1)
+            except Exception as e:
+                failures = self._failures.get(key, 0) + 1
+                if failures <= self.max_retries:
+                    self._failures[key] = failures
+                    self.counters["retries"] += 1
+                    backoff = min(2 ** failures, 60)
+                    self._not_before[key] = time.monotonic() + backoff
+                    # Put the messages back ahead of newer ones of the same group
+                    self._pending[key] = entries + self._pending.get(key, [])
+                    logger.warning(f"Failed to forward messages from {channel_id}, "
+                                   f"retrying in {backoff}s: {e}")
+                    return
+
+                self.counters["dropped"] += len(message_ids)
+                logger.error(f"Giving up forwarding messages {message_ids} from {channel_id}: {e}")
+                dropped = True
+                break
+
+        # The messages are done with, whether they were forwarded or dropped
+        self._failures.pop(key, None)
+        self._not_before.pop(key, None)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.db_handler.delete_pending_forwards, channel_id, message_ids
+        )
+        if dropped:
+            return
+
+        now = time.time()
+        self._wait_times.extend(now - queued_at for _, queued_at in entries)
+        self.counters["requests"] += 1
+        self.counters["messages"] += len(message_ids)
+        logger.info(f"Forwarded {len(message_ids)} message(s) from {channel_id} "
+                    f"to the forum under topic {topic_id}.")
+
+        if self.counters["requests"] % self.log_every == 0:
+            stats = self.stats()
+            logger.info(f"Forwarding: {stats['queue_depth']} pending, {stats['requests']} requests, "
+                        f"{stats['messages']} messages, {stats['flood_waits']} FloodWaits, "
+                        f"wait p50 {stats['wait_p50']:.1f}s p95 {stats['wait_p95']:.1f}s.")
@@ -0,0 +1,211 @@
+import heapq
+import logging
+import threading
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from bot.db import DuckDBHandler
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class LemmaVocabulary:
+    def __init__(self, db_handler: DuckDBHandler):
+        """
+        Initializes the vocabulary that interns every lemma to an integer ID.
+        The vocabulary is stored in the database next to the messages.
+
+        :param db_handler: Database handler storing the vocabulary.
+        """
+        self.db_handler = db_handler
+        self.lock = threading.Lock()
+        self._ids: Dict[str, int] = dict(self.db_handler.get_lemma_vocabulary())
+        self._pending: List[Tuple[int, str]] = []
+        logger.info(f"Loaded {len(self._ids)} lemmas into the vocabulary.")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, lemmas: Iterable[str]) -> np.ndarray:
+        """
+        Converts lemmas into a sorted array of unique lemma IDs, adding new
+        lemmas to the vocabulary.
+
+        :param lemmas: The lemmatized tokens.
+        :returns: A sorted int32 array of lemma IDs.
+        """
+        with self.lock:
+            ids = []
+            for lemma in lemmas:
+                lemma_id = self._ids.get(lemma)
+                if lemma_id is None:
+                    lemma_id = self._ids[lemma] = len(self._ids)
+                    self._pending.append((lemma_id, lemma))
+                ids.append(lemma_id)
+        return np.unique(np.array(ids, dtype=np.int32))
+
+    def flush(self) -> None:
+        """Writes the lemmas added since the last flush to the database."""
+        with self.lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        try:
+            self.db_handler.insert_lemmas(pending)
+        except Exception:
+            # Put the lemmas back so the next flush retries them
+            with self.lock:
+                self._pending[:0] = pending
+            raise
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """
+    Returns the array with room for at least the given number of items,
+    growing it geometrically so that appends stay amortized O(1).
+
+    :param array: The array to grow.
+    :param size: The required number of items.
+    :returns: The same array if it is large enough, otherwise a larger copy.
+    """
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(2 * len(array), size), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class VectorizedJaccardIndex:
+    def __init__(self, threshold: float = 0.1):
+        """
+        Initializes the exact near-duplicate index. The lemma IDs of all
+        messages are kept in one flat array, so the Jaccard similarity with
+        the whole window is computed in a few vectorized operations.
+
+        :param threshold: The Jaccard similarity above which texts are similar.
+        """
+        self.threshold = threshold
+        self._ids = np.zeros(1024, dtype=np.int32)
+        self._size = 0
+        self._max_id = 0
+
+        # Per-message start in the flat array, number of lemmas and liveness
+        self._starts = np.zeros(64, dtype=np.int64)
+        self._lengths = np.zeros(64, dtype=np.int64)
+        self._alive = np.zeros(64, dtype=np.bool_)
+        self._count = 0
+        self._keys: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._expiry_heap: List[Tuple[float, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, key: Hashable, lemma_ids: np.ndarray, timestamp: float) -> None:
+        """
+        Adds the lemma IDs of a message to the index.
+
+        :param key: The unique key of the message.
+        :param lemma_ids: The sorted unique lemma IDs of the message.
+        :param timestamp: The POSIX time of the message, used for expiry.
+        """
+        # Empty sets are never similar to anything, so they are not indexed
+        if len(lemma_ids) == 0 or key in self._positions:
+            return
+
+        self._ids = _grow(self._ids, self._size + len(lemma_ids))
+        self._starts = _grow(self._starts, self._count + 1)
+        self._lengths = _grow(self._lengths, self._count + 1)
+        self._alive = _grow(self._alive, self._count + 1)
+
+        self._ids[self._size:self._size + len(lemma_ids)] = lemma_ids
+        self._max_id = max(self._max_id, int(lemma_ids[-1]))
+        self._starts[self._count] = self._size
+        self._lengths[self._count] = len(lemma_ids)
+        self._alive[self._count] = True
+        self._positions[key] = self._count
+        self._keys.append(key)
+        self._count += 1
+        self._size += len(lemma_ids)
+        heapq.heappush(self._expiry_heap, (timestamp, key))
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Removes a message from the index.
+
+        :param key: The unique key of the message.
+        """
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+
+        self._alive[position] = False
+        # Compact the arrays once most of them is taken by removed messages
+        if len(self._positions) < self._count // 2:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rebuilds the arrays from the messages that are still in the index."""
+        alive = np.flatnonzero(self._alive[:self._count])
+        starts, lengths = self._starts[alive], self._lengths[alive]
+
+        # Gather the lemma IDs of the live messages into a new flat array
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        ids = self._ids[np.arange(int(lengths.sum())) + offsets]
+
+        self._ids, self._size = _grow(ids, 1024), len(ids)
+        self._starts = _grow(np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64), 64)
+        self._lengths = _grow(lengths.copy(), 64)
+        self._alive = _grow(np.ones(len(alive), dtype=np.bool_), 64)
+        self._count = len(alive)
+        self._keys = [self._keys[position] for position in alive]
+        self._positions = {key: position for position, key in enumerate(self._keys)}
+
+    def expire(self, before: float) -> int:
+        """
+        Removes all messages older than the given time.
+
+        :param before: The POSIX time before which messages are removed.
+        :returns: The number of removed messages.
+        """
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < before:
+            _, key = heapq.heappop(self._expiry_heap)
+            if key in self._positions:
+                self.remove(key)
+                removed += 1
+        return removed
+
+    def find_similar(self, lemma_ids: np.ndarray) -> Optional[Hashable]:
+        """
+        Finds a message whose Jaccard similarity with the lemma IDs exceeds
+        the threshold.
+
+        :param lemma_ids: The sorted unique lemma IDs of the current message.
+        :returns: The key of a similar message, or None if there is none.
+        """
+        if len(lemma_ids) == 0 or not self._positions:
+            return None
+
+        # Mark the lemmas of the current message and count the marked lemmas
+        # of every stored message with a running sum over the flat array
+        marked = np.zeros(max(self._max_id, int(lemma_ids[-1])) + 1, dtype=np.bool_)
+        marked[lemma_ids] = True
+        running = np.concatenate(([0], np.cumsum(marked[self._ids[:self._size]], dtype=np.int64)))
+
+        starts = self._starts[:self._count]
+        lengths = self._lengths[:self._count]
+        intersection = running[starts + lengths] - running[starts]
+        similarity = intersection / (lengths + len(lemma_ids) - intersection)
+
+        similar = np.flatnonzero((similarity > self.threshold) & self._alive[:self._count])
+        return self._keys[similar[0]] if len(similar) else None
+
+    def is_similar(self, lemma_ids: np.ndarray) -> bool:
+        """
+        Checks if the lemma IDs are similar to any message in the index.
+
+        :param lemma_ids: The sorted unique lemma IDs of the current message.
+        :returns: True if a similar message exists, otherwise False.
+        """
+        return self.find_similar(lemma_ids) is not None
@@ -1,3 +1,4 @@
+import os
 import logging
 import argparse
 
@@ -29,18 +30,35 @@ def main() -> None:
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Telegram News Classifier")
     parser.add_argument('--login', action='store_true', help="Authorization only, no full launch.")
+    parser.add_argument('--shard', type=int, default=0, help="Index of this shard, from 0 to shards - 1.")
     args = parser.parse_args()
 
+    # With several shards, every shard keeps its own database next to the
+    # one of the dedup server, which stores the shared message window
+    db_path = config.bot_settings.get("db_path")
+    shards = config.bot_settings.get("shards", 1)
+    if not 0 <= args.shard < shards:
+        logger.error(f"Shard {args.shard} does not exist, expected 0 to {shards - 1}.")
+        return
+    if shards > 1 and not config.bot_settings.get("dedup_server"):
+        logger.error("Running several shards requires dedup_server.")
+        return
+    if config.bot_settings.get("dedup_server"):
+        root, extension = os.path.splitext(db_path)
+        db_path = f"{root}_shard{args.shard}{extension}"
+
     # Initialize the database handler with the path from the configuration
-    db_handler = DuckDBHandler(db_file=config.bot_settings.get("db_path"))
+    db_handler = DuckDBHandler(db_file=db_path)
 
-    # Set up a recurring task to clean up old messages from the database
+    # Set up a recurring task to drop expired hourly tables from the database
     scheduler = BackgroundScheduler()
-    scheduler.add_job(db_handler.cleanup_old_messages, 'interval', hours=config.bot_settings.get("message_lifetime"))
+    scheduler.add_job(db_handler.cleanup_old_messages, 'interval', 
+                      minutes=config.bot_settings.get("cleanup_interval", 5),
+                      args=[config.bot_settings.get("message_lifetime")])
     scheduler.start()
 
     # Initialize and start the Telegram bot manager
-    TelegramManager(config, telegram_config, db_handler, args.login)
+    TelegramManager(config, telegram_config, db_handler, args.login, args.shard)
 
 
 if __name__ == "__main__":
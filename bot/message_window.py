@@ -0,0 +1,194 @@
+import time
+import heapq
+import logging
+import datetime
+import threading
+from typing import List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from bot.db import DuckDBHandler
+from bot.config import MainConfig
+from bot.minhash import MinHashIndex
+from bot.embeddings import EmbeddingIndex
+from bot.lemmas import LemmaVocabulary, VectorizedJaccardIndex
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class MessageWindow:
+    def __init__(self, db_handler: DuckDBHandler, message_lifetime: int,
+                 similarity_index: Union[MinHashIndex, VectorizedJaccardIndex, EmbeddingIndex],
+                 vocabulary: Optional[LemmaVocabulary] = None):
+        """
+        Initializes the in-memory window of recent messages. Duplicate and
+        similarity checks are answered from memory, while new messages are
+        written to the database in batches by flush().
+
+        :param db_handler: Database handler used as the write-behind store.
+        :param message_lifetime: The time in hours messages stay in the window.
+        :param similarity_index: The index used for near-duplicate detection.
+        :param vocabulary: The vocabulary that interns lemmas to integer IDs.
+                           Without a vocabulary, messages are compared by
+                           their sentence embeddings.
+        """
+        self.db_handler = db_handler
+        self.message_lifetime = message_lifetime
+        self.similarity_index = similarity_index
+        self.vocabulary = vocabulary
+
+        # Guards the window, the workers and the flush job use it concurrently
+        self.lock = threading.RLock()
+        self._message_keys: Set[Tuple[int, int]] = set()
+        self._group_keys: Set[Tuple[int, int]] = set()
+        self._expiry_heap: List[Tuple[float, int, int, Optional[int]]] = []
+        self._pending: List[Tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._message_keys)
+
+    def load(self) -> None:
+        """Rehydrates the window from the messages stored in the database."""
+        rows = self.db_handler.get_recent_messages(self.message_lifetime)
+        with self.lock:
+            for message_id, channel_id, grouped_id, lemma_ids, date, embedding in rows:
+                if self.vocabulary is not None:
+                    features = np.array(lemma_ids or [], dtype=np.int32)
+                else:
+                    features = np.array(embedding, dtype=np.float32) if embedding else None
+                self._remember(message_id, channel_id, grouped_id, features, date.timestamp())
+        logger.info(f"Loaded {len(rows)} recent messages into the message window.")
+
+    def _remember(self, message_id: int, channel_id: int, grouped_id: Optional[int],
+                  features: Optional[np.ndarray], timestamp: float) -> None:
+        """
+        Adds the message to the in-memory structures without persisting it.
+
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel where the message was posted.
+        :param grouped_id: Group identifier from messages.
+        :param features: The sorted unique lemma IDs or the embedding of the message.
+        :param timestamp: The POSIX time of the message.
+        """
+        self._message_keys.add((channel_id, message_id))
+        if grouped_id is not None:
+            self._group_keys.add((channel_id, grouped_id))
+        self.similarity_index.add((channel_id, message_id), features, timestamp)
+        heapq.heappush(self._expiry_heap, (timestamp, message_id, channel_id, grouped_id))
+
+    def expire(self) -> int:
+        """
+        Removes messages older than the message lifetime from the window.
+
+        :returns: The number of removed messages.
+        """
+        before = time.time() - self.message_lifetime * 3600
+        removed = 0
+        with self.lock:
+            while self._expiry_heap and self._expiry_heap[0][0] < before:
+                _, message_id, channel_id, grouped_id = heapq.heappop(self._expiry_heap)
+                self._message_keys.discard((channel_id, message_id))
+                if grouped_id is not None:
+                    self._group_keys.discard((channel_id, grouped_id))
+                removed += 1
+            self.similarity_index.expire(before)
+        return removed
+
+    def contains(self, message_id: int, channel_id: int, grouped_id: Optional[int]) -> bool:
+        """
+        Checks whether the message or another message of its group is in the
+        window.
+
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel where the message was posted.
+        :param grouped_id: Group identifier from messages.
+        :returns: True if the message exists, False otherwise.
+        """
+        with self.lock:
+            return (channel_id, message_id) in self._message_keys or \
+                   (grouped_id is not None and (channel_id, grouped_id) in self._group_keys)
+
+    def add_if_new(self, message_id: int, channel_id: int, grouped_id: Optional[int],
+                   text: str, lemmas: Set[str], date: datetime.datetime,
+                   embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        """
+        Adds the message to the window unless it is a duplicate or similar to
+        a recent message. The check and the insert are atomic.
+
+        :param message_id: The ID of the message.
+        :param channel_id: The ID of the channel where the message was posted.
+        :param grouped_id: Group identifier from messages.
+        :param text: The preprocessed text of the message.
+        :param lemmas: The set of lemmatized tokens of the message.
+        :param date: Timestamp when the message was published.
+        :param embedding: The unit sentence embedding of the message, used
+                          instead of the lemmas when there is no vocabulary.
+        :returns: "duplicate" or "similar" if the message was rejected,
+                  otherwise None.
+        """
+        if self.vocabulary is not None:
+            features = lemma_ids = self.vocabulary.intern(lemmas)
+        else:
+            features, lemma_ids = embedding, np.zeros(0, dtype=np.int32)
+
+        with self.lock:
+            self.expire()
+            if self.contains(message_id, channel_id, grouped_id):
+                return "duplicate"
+            if self.similarity_index.is_similar(features):
+                return "similar"
+
+            self._remember(message_id, channel_id, grouped_id, features, date.timestamp())
+            self._pending.append((message_id, channel_id, grouped_id, text, lemma_ids.tolist(), date,
+                                  embedding.tolist() if embedding is not None else None))
+        return None
+
+    def flush(self) -> None:
+        """Writes the lemmas and messages added since the last flush to the database."""
+        with self.lock:
+            pending, self._pending = self._pending, []
+
+        try:
+            # Lemmas of the taken messages were interned before the messages were
+            # added, so writing them first means stored messages never refer to
+            # unknown IDs
+            if self.vocabulary is not None:
+                self.vocabulary.flush()
+            if pending:
+                self.db_handler.insert_messages(pending)
+        except Exception:
+            # Put the messages back so the next flush retries them
+            with self.lock:
+                self._pending[:0] = pending
+            raise
+
+def create_message_window(config: MainConfig, db_handler: DuckDBHandler) -> MessageWindow:
+    """
+    Creates the message window with the similarity index and vocabulary
+    selected by the configuration and loads the recent messages into it.
+
+    :param config: Main configuration object with global settings.
+    :param db_handler: Database handler used as the write-behind store.
+    :returns: The loaded message window.
+    """
+    message_lifetime = config.bot_settings.get("message_lifetime")
+    # In embedding mode messages are compared by the sentence embeddings
+    # returned by the classifier, otherwise by their lemmas
+    if config.bot_settings.get("dedup_mode", "lemmas") == "embeddings":
+        similarity_index = EmbeddingIndex(
+            threshold=config.bot_settings.get("embedding_threshold", 0.9)
+        )
+        window = MessageWindow(db_handler, message_lifetime, similarity_index)
+    else:
+        similarity_threshold = config.bot_settings.get("similarity_threshold", 0.1)
+        if config.bot_settings.get("similarity_index", "minhash") == "exact":
+            similarity_index = VectorizedJaccardIndex(threshold=similarity_threshold)
+        else:
+            similarity_index = MinHashIndex(
+                threshold=similarity_threshold,
+                num_perm=config.bot_settings.get("minhash_permutations", 128)
+            )
+        window = MessageWindow(db_handler, message_lifetime, similarity_index,
+                               LemmaVocabulary(db_handler))
+    window.load()
+    return window
@@ -0,0 +1,209 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class MetricsRegistry:
+    def __init__(self, max_samples: Optional[int] = 10000):
+        """
+        Initializes the registry of counters, gauges and timing spans. Every
+        span keeps its most recent durations to compute latency percentiles.
+
+        :param max_samples: The number of durations kept per span, None keeps all.
+        """
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.labeled_gauges: Dict[str, Tuple[str, Callable[[], Dict]]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """
+        Increases a counter.
+
+        :param name: The name of the counter.
+        :param value: The amount to add.
+        """
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Records the duration of one span.
+
+        :param name: The name of the span.
+        :param seconds: The duration in seconds.
+        """
+        with self.lock:
+            self.samples[name].append(seconds)
+            self.totals[name] += seconds
+            self.counts[name] += 1
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """
+        Records the time spent in the block as a span, including the time
+        spent waiting in awaits.
+
+        :param name: The name of the span.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def latency(self, name: str, percentiles: Sequence[float] = (50, 95, 99)) -> Dict[str, float]:
+        """
+        Summarizes the recorded durations of a span in milliseconds.
+
+        :param name: The name of the span.
+        :param percentiles: The percentiles to compute over the kept durations.
+        :returns: A dictionary with the count, mean and percentiles.
+        """
+        with self.lock:
+            samples = np.array(self.samples[name], dtype=np.float64) * 1000
+            count, total = self.counts[name], self.totals[name]
+
+        summary = {"count": count, "mean_ms": total * 1000 / count if count else 0.0}
+        for percentile in percentiles:
+            summary[f"p{percentile:g}_ms"] = float(np.percentile(samples, percentile)) if len(samples) else 0.0
+        return summary
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Returns all counters and the latency summary of all spans.
+
+        :returns: A dictionary with "counters" and "latency" sections.
+        """
+        with self.lock:
+            counters, names = dict(self.counters), list(self.samples)
+        return {"counters": counters, "latency": {name: self.latency(name) for name in names}}
+
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """
+        Registers a value that is read when the metrics are collected.
+
+        :param name: The name of the gauge.
+        :param callback: Function returning the current value.
+        """
+        with self.lock:
+            self.gauges[name] = callback
+
+    def register_labeled_gauge(self, name: str, label: str, callback: Callable[[], Dict]) -> None:
+        """
+        Registers a set of values that is read when the metrics are collected,
+        e.g. the queue length of every channel.
+
+        :param name: The name of the gauge.
+        :param label: The name of the label that tells the values apart.
+        :param callback: Function returning the current values by label value.
+        """
+        with self.lock:
+            self.labeled_gauges[name] = (label, callback)
+
+    def render_prometheus(self, prefix: str = "news_classifier") -> str:
+        """
+        Renders the counters, gauges and spans in the Prometheus text format.
+        Spans are exported as summaries with quantiles over the kept durations.
+
+        :param prefix: The prefix of all metric names.
+        :returns: The metrics as text.
+        """
+        with self.lock:
+            counters, gauges, names = dict(self.counters), dict(self.gauges), list(self.samples)
+            labeled_gauges = dict(self.labeled_gauges)
+
+        lines = []
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, callback in sorted(gauges.items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {float(callback())}")
+        for name, (label, callback) in sorted(labeled_gauges.items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for key, value in sorted(callback().items()):
+                lines.append(f'{prefix}_{name}{{{label}="{key}"}} {float(value)}')
+
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for name in sorted(names):
+            with self.lock:
+                samples = np.array(self.samples[name], dtype=np.float64)
+                count, total = self.counts[name], self.totals[name]
+            for quantile in (0.5, 0.95, 0.99):
+                value = float(np.quantile(samples, quantile)) if len(samples) else 0.0
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} {value}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self) -> None:
+        """Logs the counters and the p50/p95 latency of every span in one line each."""
+        summary = self.summary()
+        counters = ", ".join(f"{name} {value}" for name, value in sorted(summary["counters"].items()))
+        logger.info(f"Counters: {counters or 'none'}")
+        spans = ", ".join(f"{name} p50 {latency['p50_ms']:.1f} ms p95 {latency['p95_ms']:.1f} ms"
+                          for name, latency in summary["latency"].items())
+        logger.info(f"Stage latency: {spans or 'none'}")
+
+        # Only the largest values are logged, e.g. the channels with the longest queues
+        with self.lock:
+            labeled_gauges = dict(self.labeled_gauges)
+        for name, (label, callback) in sorted(labeled_gauges.items()):
+            values = sorted(callback().items(), key=lambda item: item[1], reverse=True)[:5]
+            if values:
+                logger.info(f"{name}: " + ", ".join(f"{label} {key} {value}" for key, value in values))
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100) -> asyncio.AbstractServer:
+        """
+        Starts a minimal HTTP server that serves the metrics at /metrics.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on.
+        :returns: The running server.
+        """
+        server = await asyncio.start_server(self._handle_request, host, port)
+        logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+        return server
+
+    async def _handle_request(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> None:
+        """
+        Answers one HTTP request to the metrics server.
+
+        :param reader: The stream of the request.
+        :param writer: The stream of the response.
+        """
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Skip the headers of the request
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render_prometheus().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
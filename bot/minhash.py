@@ -0,0 +1,184 @@
+import math
+import heapq
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used by the universal hash functions. It is small enough for
+# the products of the hash coefficients and 32-bit lemma IDs to fit in uint64
+_PRIME = np.uint64((1 << 31) - 1)
+
+def choose_band_rows(threshold: float, num_perm: int, recall: float = 0.99) -> int:
+    """
+    Chooses the number of rows per LSH band. It takes the largest band that
+    still turns a pair with the threshold similarity into a candidate with
+    the required probability, which keeps the candidate lists as short as
+    possible.
+
+    :param threshold: The Jaccard similarity threshold.
+    :param num_perm: The number of hash functions in a signature.
+    :param recall: The required probability of finding a pair at the threshold.
+    :returns: The number of rows per band.
+    """
+    best_rows = 1
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best_rows = rows
+    return best_rows
+
+def choose_min_collisions(threshold: float, rows: int, bands: int, 
+                          recall: float = 0.999) -> int:
+    """
+    Chooses how many bands a candidate must share with the query before it
+    is verified. The number of shared bands follows a binomial distribution,
+    so candidates sharing fewer bands than a pair at the threshold would with
+    the required probability are skipped without computing the Jaccard.
+
+    :param threshold: The Jaccard similarity threshold.
+    :param rows: The number of rows per band.
+    :param bands: The number of bands.
+    :param recall: The required probability of keeping a pair at the threshold.
+    :returns: The minimal number of shared bands.
+    """
+    probability = threshold ** rows
+    cumulative = 0.0
+    for collisions in range(bands + 1):
+        cumulative += math.comb(bands, collisions) * probability ** collisions \
+                      * (1 - probability) ** (bands - collisions)
+        if cumulative > 1 - recall:
+            return max(collisions, 1)
+    return 1
+
+class MinHashIndex:
+    def __init__(self, threshold: float = 0.1, num_perm: int = 128, seed: int = 1):
+        """
+        Initializes the MinHash index with LSH banding. Candidates returned by
+        the bands are verified with the exact Jaccard similarity.
+
+        :param threshold: The Jaccard similarity above which texts are similar.
+        :param num_perm: The number of hash functions in a signature.
+        :param seed: The seed for the hash function coefficients.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.rows = choose_band_rows(threshold, num_perm)
+        self.bands = num_perm // self.rows
+        self.min_collisions = choose_min_collisions(threshold, self.rows, self.bands)
+
+        # Coefficients of the universal hash functions (a * x + b) mod p
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        self._b = generator.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+
+        self._buckets: List[Dict[bytes, Set[Hashable]]] = [defaultdict(set)
+                                                           for _ in range(self.bands)]
+        self._entries: Dict[Hashable, Tuple[np.ndarray, List[bytes]]] = {}
+        self._expiry_heap: List[Tuple[float, Hashable]] = []
+        logger.info(f"MinHash index ready with {self.bands} band(s) of {self.rows} row(s), "
+                    f"verifying candidates sharing {self.min_collisions} band(s).")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, lemma_ids: np.ndarray) -> List[bytes]:
+        """
+        Computes the MinHash signature of the lemma IDs and splits it into bands.
+
+        :param lemma_ids: A non-empty array of lemma IDs.
+        :returns: A list with the bucket key of every band.
+        """
+        hashes = lemma_ids.astype(np.uint64) % _PRIME
+        signature = ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+
+    def add(self, key: Hashable, lemma_ids: np.ndarray, timestamp: float) -> None:
+        """
+        Adds the lemma IDs of a message to the index.
+
+        :param key: The unique key of the message.
+        :param lemma_ids: The sorted unique lemma IDs of the message.
+        :param timestamp: The POSIX time of the message, used for expiry.
+        """
+        # Empty sets are never similar to anything, so they are not indexed
+        if len(lemma_ids) == 0 or key in self._entries:
+            return
+
+        band_keys = self._band_keys(lemma_ids)
+        for buckets, band_key in zip(self._buckets, band_keys):
+            buckets[band_key].add(key)
+        self._entries[key] = (lemma_ids, band_keys)
+        heapq.heappush(self._expiry_heap, (timestamp, key))
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Removes a message from the index.
+
+        :param key: The unique key of the message.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for buckets, band_key in zip(self._buckets, entry[1]):
+            bucket = buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del buckets[band_key]
+
+    def expire(self, before: float) -> int:
+        """
+        Removes all messages older than the given time.
+
+        :param before: The POSIX time before which messages are removed.
+        :returns: The number of removed messages.
+        """
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < before:
+            _, key = heapq.heappop(self._expiry_heap)
+            if key in self._entries:
+                self.remove(key)
+                removed += 1
+        return removed
+
+    def find_similar(self, lemma_ids: np.ndarray) -> Optional[Hashable]:
+        """
+        Finds a message whose Jaccard similarity with the lemma IDs exceeds
+        the threshold.
+
+        :param lemma_ids: The sorted unique lemma IDs of the current message.
+        :returns: The key of a similar message, or None if there is none.
+        """
+        if len(lemma_ids) == 0:
+            return None
+
+        # Count the bands every candidate shares with the current message
+        collisions = Counter()
+        for buckets, band_key in zip(self._buckets, self._band_keys(lemma_ids)):
+            collisions.update(buckets.get(band_key, ()))
+
+        # Verify the most likely candidates first with the exact Jaccard similarity
+        for key, count in collisions.most_common():
+            if count < self.min_collisions:
+                break
+
+            stored_ids = self._entries[key][0]
+            intersection = len(np.intersect1d(lemma_ids, stored_ids, assume_unique=True))
+            if intersection / (len(lemma_ids) + len(stored_ids) - intersection) > self.threshold:
+                return key
+        return None
+
+    def is_similar(self, lemma_ids: np.ndarray) -> bool:
+        """
+        Checks if the lemma IDs are similar to any message in the index.
+
+        :param lemma_ids: The sorted unique lemma IDs of the current message.
+        :returns: True if a similar message exists, otherwise False.
+        """
+        return self.find_similar(lemma_ids) is not None
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from bot.config import MainConfig
+from bot.process_pool import ProcessPool, preload_modules
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# A short text run through the models once before the first real message
+WARM_UP_TEXT = "курс рубля вырос на торгах московской биржи после заявления центробанка"
+
+class Models:
+    def __init__(self, classifier, text_similarity=None, fast_classifier=None):
+        """
+        Holds the loaded models of the message pipeline.
+
+        :param classifier: The TextClassifier, or a ProcessPool serving it.
+        :param text_similarity: The TextSimilarity lemmatizer, or a ProcessPool
+                                serving it, None in embedding dedup mode.
+        :param fast_classifier: The HashedNgramClassifier of the cascade, if configured.
+        """
+        self.classifier = classifier
+        self.text_similarity = text_similarity
+        self.fast_classifier = fast_classifier
+
+    @staticmethod
+    def workers(model) -> int:
+        """
+        Returns the number of batches a model can process at the same time.
+
+        :param model: A loaded model or a ProcessPool serving it.
+        :returns: The number of worker processes, 1 for a model in this process.
+        """
+        return model.workers if isinstance(model, ProcessPool) else 1
+
+    def close(self) -> None:
+        """Stops the worker processes serving the models, if any."""
+        for model in (self.classifier, self.text_similarity):
+            if isinstance(model, ProcessPool):
+                model.close()
+
+def _load_classifier(config: MainConfig):
+    """
+    Imports PyTorch and loads the text classifier.
+
+    :param config: Main configuration object with global settings.
+    :returns: The TextClassifier.
+    """
+    # The tokenizers library reads the setting when it tokenizes a batch
+    tokenizers_parallelism = config.bot_settings.get("tokenizers_parallelism")
+    if tokenizers_parallelism is not None:
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if tokenizers_parallelism else "false"
+
+    from bot.classifier import TextClassifier
+
+    return TextClassifier(
+        config.bot_settings.get("model_path"),
+        backend=config.bot_settings.get("classifier_backend", "torch"),
+        threads=config.bot_settings.get("torch_threads", 0),
+        interop_threads=config.bot_settings.get("torch_interop_threads", 0)
+    )
+
+def _load_text_similarity(config: MainConfig):
+    """
+    Imports spaCy and loads the lemmatizer.
+
+    :param config: Main configuration object with global settings.
+    :returns: The TextSimilarity lemmatizer.
+    """
+    from bot.text_similarity import TextSimilarity, DEFAULT_EXCLUDE
+
+    return TextSimilarity(
+        language_model=config.bot_settings.get("lemma_model", "ru_core_news_sm"),
+        engine=config.bot_settings.get("lemma_engine", "model"),
+        exclude=config.bot_settings.get("lemma_exclude", DEFAULT_EXCLUDE),
+        cache_size=config.bot_settings.get("lemma_cache_size", 100000),
+        batch_size=config.bot_settings.get("lemma_batch_size", 64)
+    )
+
+def load_models(config: MainConfig) -> Models:
+    """
+    Loads the classifier and the lemmatizer at the same time, each in its
+    own thread, together with the fast classifier of the cascade.
+
+    :param config: Main configuration object with global settings.
+    :returns: The loaded models.
+    """
+    start_time = time.perf_counter()
+    use_embeddings = config.bot_settings.get("dedup_mode", "lemmas") == "embeddings"
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load") as executor:
+        classifier = executor.submit(_load_classifier, config)
+        # Embedding mode takes the similarity from the classifier, so spaCy is not loaded
+        text_similarity = None if use_embeddings else executor.submit(_load_text_similarity, config)
+
+        fast_classifier = None
+        cascade_model_path = config.bot_settings.get("cascade_model_path")
+        if cascade_model_path and not use_embeddings:
+            from bot.cascade import HashedNgramClassifier
+            fast_classifier = HashedNgramClassifier.load(cascade_model_path)
+
+        models = Models(classifier.result(),
+                        text_similarity.result() if text_similarity is not None else None,
+                        fast_classifier)
+    logger.info(f"Models loaded in {time.perf_counter() - start_time:.1f}s.")
+
+    # Serve the models from worker processes started after loading, so that
+    # inference runs outside the process of the Telegram client
+    threads = config.bot_settings.get("process_threads", 1)
+    timeout = config.bot_settings.get("process_timeout", 120)
+    classifier_processes = config.bot_settings.get("classifier_processes", 0)
+    lemma_processes = config.bot_settings.get("lemma_processes", 0) if models.text_similarity is not None else 0
+    # The fork server starts with the first pool and imports the modules of
+    # both models once, so that the workers do not import PyTorch or spaCy
+    pooled = [model for model, processes in ((models.classifier, classifier_processes),
+                                             (models.text_similarity, lemma_processes)) if processes]
+    if pooled:
+        preload_modules(type(model).__module__ for model in pooled)
+    if classifier_processes:
+        models.classifier = ProcessPool(models.classifier, classifier_processes, threads,
+                                        "classifier", timeout)
+    if lemma_processes:
+        models.text_similarity = ProcessPool(models.text_similarity, lemma_processes, threads,
+                                             "lemmatizer", timeout)
+    return models
+
+def start_loading_models(config: MainConfig) -> Future:
+    """
+    Starts loading the models in a background thread, so that the caller can
+    connect to Telegram in the meantime.
+
+    :param config: Main configuration object with global settings.
+    :returns: A future with the loaded models.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="models")
+    future = executor.submit(load_models, config)
+    # The thread exits once the models are loaded
+    executor.shutdown(wait=False)
+    return future
+
+def _run_everywhere(model, method: str, *args) -> None:
+    """
+    Runs a method of the model, once in every worker process if it is
+    served by a process pool.
+
+    :param model: A loaded model or a ProcessPool serving it.
+    :param method: The name of the method.
+    :param args: The positional arguments of the method.
+    """
+    if isinstance(model, ProcessPool):
+        model.broadcast(method, *args)
+    else:
+        getattr(model, method)(*args)
+
+def warm_up(models: Models, batch_size: int = 16, embeddings: bool = False) -> None:
+    """
+    Runs the models once on a full batch, so that the first real messages
+    do not pay for lazy initialization and memory allocation.
+
+    :param models: The loaded models.
+    :param batch_size: The number of texts in the warm-up batch.
+    :param embeddings: Whether the classifier computes embeddings as well.
+    """
+    start_time = time.perf_counter()
+    texts = [WARM_UP_TEXT] * batch_size
+    _run_everywhere(models.classifier,
+                    "classify_with_embeddings_batch" if embeddings else "classify_batch",
+                    texts, batch_size)
+    if models.text_similarity is not None:
+        _run_everywhere(models.text_similarity, "get_lemmas_batch", texts)
+    if models.fast_classifier is not None:
+        models.fast_classifier.predict(WARM_UP_TEXT)
+    logger.info(f"Models warmed up in {time.perf_counter() - start_time:.2f}s.")
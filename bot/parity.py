@@ -0,0 +1,70 @@
+import sys
+import time
+import logging
+import argparse
+
+import numpy as np
+
+from bot.config import MainConfig
+from bot.logger import setup_logger
+from bot.preprocess import preprocess_batch
+from bot.corpus import DEFAULT_CORPUS_PATH, load_labelled_texts
+from bot.classifier import BACKENDS, TextClassifier
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+def predict(classifier: TextClassifier, texts, batch_size: int) -> np.ndarray:
+    """
+    Classifies the texts and logs the throughput.
+
+    :param classifier: The classifier to run.
+    :param texts: The preprocessed texts.
+    :param batch_size: The number of texts in one forward pass.
+    :returns: An array of predicted class indexes.
+    """
+    start_time = time.perf_counter()
+    predictions = np.array(classifier.classify_batch(texts, batch_size))
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Backend '{classifier.backend}' classified {len(texts)} texts "
+                f"in {elapsed:.1f}s ({len(texts) / elapsed:.1f} texts/s).")
+    return predictions
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Compare a classifier backend with the PyTorch model.")
+    parser.add_argument('--backend', choices=BACKENDS, required=True, help="Backend to check.")
+    parser.add_argument('--reference', choices=BACKENDS, default="torch", help="Reference backend.")
+    parser.add_argument('--config', default="config/config.yaml", help="Main configuration file.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with labelled messages.")
+    parser.add_argument('--limit', type=int, default=None, help="Maximum number of messages.")
+    parser.add_argument('--batch-size', type=int, default=32, help="Texts per forward pass.")
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help="Fail if fewer predictions agree with the reference.")
+    args = parser.parse_args()
+
+    config = MainConfig(args.config)
+    model_path = config.bot_settings.get("model_path")
+    messages = load_labelled_texts(config.categories, args.corpus, args.limit)
+    texts = preprocess_batch(message["text"] for message in messages)
+    labels = np.array([message["label"] for message in messages])
+
+    reference = predict(TextClassifier(model_path, args.reference), texts, args.batch_size)
+    candidate = predict(TextClassifier(model_path, args.backend), texts, args.batch_size)
+
+    # Compare the argmax of both backends and their accuracy against the corpus labels
+    agreement = float(np.mean(reference == candidate))
+    logger.info(f"Argmax agreement of '{args.backend}' with '{args.reference}': {agreement:.2%}")
+    logger.info(f"Label accuracy: '{args.reference}' {np.mean(reference == labels):.2%}, "
+                f"'{args.backend}' {np.mean(candidate == labels):.2%}")
+
+    if agreement < args.min_agreement:
+        logger.error(f"Agreement is below the required {args.min_agreement:.2%}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
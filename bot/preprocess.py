@@ -1,47 +1,80 @@
 import re
+from typing import Iterable, List
 
+# The patterns of preprocess_text, compiled once. Every step runs on the
+# output of the previous one, so the steps keep their order
+HTML_TAG = re.compile(r"<.*?>")
+BOLD = re.compile(r"(\*\*|__)(.*?)\1")
+ITALIC = re.compile(r"(\*|_)(.*?)\1")
+STRIKETHROUGH = re.compile(r"~~(.*?)~~")
+INLINE_CODE = re.compile(r"`{1,2}(.*?)`{1,2}")
+HEADING = re.compile(r"#{1,6}\s*")
+LINK = re.compile(r"\[(.*?)\]\(.*?\)")
+IMAGE = re.compile(r"!\[.*?\]\(.*?\)")
+BLOCKQUOTE = re.compile(r">\s*")
+NON_LETTERS = re.compile(r"[^a-zA-Zа-яА-ЯёЁ\s]")
 
 def preprocess_text(text: str) -> str:
     """
     Preprocesses the input text and returns the cleaned text.
 
     :param text: The raw input text to preprocess.
-    :returns: The preprocessed text as a lowercase string with special 
+    :returns: The preprocessed text as a lowercase string with special
               characters and Markdown/HTML tags removed.
     """
 
+    # Every Markdown/HTML step is skipped when the text does not contain
+    # the characters its pattern starts with, since it could not match
+
     # Remove HTML tags
-    text = re.sub(r"<.*?>", "", text)
-    
+    if "<" in text:
+        text = HTML_TAG.sub("", text)
+
     # Remove bold Markdown syntax (e.g., **bold** or __bold__)
-    text = re.sub(r"(\*\*|__)(.*?)\1", r"\2", text)
-    
+    if "**" in text or "__" in text:
+        text = BOLD.sub(r"\2", text)
+
     # Remove italic Markdown syntax (e.g., *italic* or _italic_)
-    text = re.sub(r"(\*|_)(.*?)\1", r"\2", text)
-    
+    if "*" in text or "_" in text:
+        text = ITALIC.sub(r"\2", text)
+
     # Remove strikethrough Markdown syntax (e.g., ~~strikethrough~~)
-    text = re.sub(r"~~(.*?)~~", r"\1", text)
-    
+    if "~~" in text:
+        text = STRIKETHROUGH.sub(r"\1", text)
+
     # Remove inline code Markdown syntax (e.g., `code`)
-    text = re.sub(r"`{1,2}(.*?)`{1,2}", r"\1", text)
-    
+    if "`" in text:
+        text = INLINE_CODE.sub(r"\1", text)
+
     # Remove Markdown headings (e.g., # Heading)
-    text = re.sub(r"#{1,6}\s*", "", text)
-    
+    if "#" in text:
+        text = HEADING.sub("", text)
+
     # Remove Markdown links (e.g., [link](url))
-    text = re.sub(r"\[(.*?)\]\(.*?\)", r"\1", text)
-    
+    if "](" in text:
+        text = LINK.sub(r"\1", text)
+
     # Remove Markdown images (e.g., ![alt text](image url))
-    text = re.sub(r"!\[.*?\]\(.*?\)", "", text)
-    
+    if "![" in text:
+        text = IMAGE.sub("", text)
+
     # Remove blockquotes (e.g., > quoted text)
-    text = re.sub(r">\s*", "", text)
-    
-    # Remove all non-alphabetical characters and digits
-    text = re.sub(r"[^a-zA-Zа-яА-ЯёЁ\s]", "", text)
-    
-    # Replace multiple spaces with a single space and strip leading/trailing spaces
-    text = re.sub(r"\s+", " ", text).strip()
-    
+    if ">" in text:
+        text = BLOCKQUOTE.sub("", text)
+
+    # Remove all non-alphabetical characters and digits, then replace
+    # multiple spaces with a single space and strip leading/trailing spaces.
+    # str.split() splits on the same whitespace as \s
+    text = " ".join(NON_LETTERS.sub("", text).split())
+
     # Convert all text to lowercase
     return text.lower()
+
+def preprocess_batch(texts: Iterable[str]) -> List[str]:
+    """
+    Preprocesses several texts.
+
+    :param texts: The raw input texts to preprocess.
+    :returns: A list of preprocessed texts in the same order.
+    """
+    return [preprocess_text(text) for text in texts]
@@ -0,0 +1,211 @@
+import os
+import sys
+import queue
+import logging
+import multiprocessing
+from typing import Any, Dict, Iterable
+
+from bot.logger import setup_logger
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+def _worker_main(connection, target: Any, threads: int) -> None:
+    """
+    Runs in a worker process: calls methods of the object received from the
+    main process for the requests received over the connection and sends
+    back the results.
+
+    :param connection: The worker's end of the pipe to the main process.
+    :param target: The object received from the main process, e.g. the classifier.
+    :param threads: The number of PyTorch threads of the worker.
+    """
+    # The worker does not inherit the logging setup of the main process
+    setup_logger()
+    # PyTorch is only configured when the target uses it
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    prepare = getattr(target, "prepare_worker", None)
+    if prepare is not None:
+        prepare(threads)
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+
+        method, args = request
+        try:
+            connection.send((True, getattr(target, method)(*args)))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+def preload_modules(modules: Iterable[str]) -> None:
+    """
+    Sets the modules the fork server imports once for all worker processes,
+    e.g. those of the classifier and the lemmatizer. The fork server starts
+    with the first pool, so this has to be called before any pool is created.
+
+    :param modules: The names of the modules.
+    """
+    multiprocessing.get_context("forkserver").set_forkserver_preload(sorted(set(modules)))
+
+class ProcessPool:
+    def __init__(self, target: Any, workers: int, threads: int = 1, name: str = "pool",
+                 timeout: float = 120):
+        """
+        Starts worker processes that serve method calls on a loaded object,
+        e.g. the classifier or the lemmatizer. The workers are started from a
+        fork server, a separate process without the threads of the bot, since
+        a process forked from the bot would inherit locks held by them. The
+        object is sent to every worker; PyTorch weights are moved to shared
+        memory first, so the workers map them instead of getting their own
+        copies.
+
+        :param target: The loaded object whose methods the workers call.
+        :param workers: The number of worker processes.
+        :param threads: The number of PyTorch threads per worker.
+        :param name: The name used for the processes and in logs.
+        :param timeout: The time in seconds a call may take before its worker
+                        is considered hung and replaced.
+        """
+        self.workers = workers
+        self.name = name
+        self.timeout = timeout
+        self._target = target
+        self._threads = threads
+        share_memory = getattr(target, "share_memory", None)
+        if share_memory is not None:
+            share_memory()
+            # Registers the pickling of tensors through shared memory
+            import torch.multiprocessing  # noqa: F401
+
+        # The modules the fork server imports are set by preload_modules()
+        self._context = multiprocessing.get_context("forkserver")
+
+        # Every worker has its own pipe and serves one call at a time
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._connections: Dict[int, Any] = {}
+        self._idle: "queue.Queue" = queue.Queue()
+        for index in range(workers):
+            self._idle.put(self._start_worker(index))
+        logger.info(f"Started {workers} {name} process(es) with {threads} thread(s) each "
+                    f"(main process {os.getpid()}).")
+
+    def _start_worker(self, index: int):
+        """
+        Starts the worker process with the given index.
+
+        :param index: The index of the worker, from 0 to workers - 1.
+        :returns: The main process's end of the pipe to the worker.
+        """
+        parent_end, child_end = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_end, self._target, self._threads),
+                                        name=f"{self.name}-{index}", daemon=True)
+        process.start()
+        child_end.close()
+        self._processes[index] = process
+        self._connections[index] = parent_end
+        return parent_end
+
+    def _replace_worker(self, connection):
+        """
+        Stops the worker behind a broken or hung connection and starts a new
+        one in its place, so that later calls do not go to that worker.
+
+        :param connection: The connection that failed.
+        :returns: The connection to the new worker.
+        """
+        index = next(index for index, known in self._connections.items() if known is connection)
+        connection.close()
+        process = self._processes[index]
+        if process.is_alive():
+            process.kill()
+        process.join(timeout=5)
+        logger.warning(f"{self.name} process {process.name} stopped with code {process.exitcode}, "
+                       f"starting a new one.")
+        return self._start_worker(index)
+
+    def __getattr__(self, method: str):
+        """Returns a function that runs the method of the target in a worker."""
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+    def call(self, method: str, *args: Any) -> Any:
+        """
+        Runs a method of the target in the next idle worker and waits for
+        its result, at most `timeout` seconds. Can be called from several
+        threads at once.
+
+        :param method: The name of the method.
+        :param args: The positional arguments of the method.
+        :returns: The result of the method.
+        """
+        connection = self._idle.get()
+        try:
+            connection.send((method, args))
+            if not connection.poll(self.timeout):
+                connection = self._replace_worker(connection)
+                raise RuntimeError(f"A {self.name} process did not answer within {self.timeout}s.")
+            success, result = connection.recv()
+        except (EOFError, OSError):
+            connection = self._replace_worker(connection)
+            raise RuntimeError(f"A {self.name} process exited.") from None
+        finally:
+            self._idle.put(connection)
+
+        if not success:
+            raise RuntimeError(f"{self.name} process failed: {result}")
+        return result
+
+    def broadcast(self, method: str, *args: Any) -> None:
+        """
+        Runs a method of the target once in every worker, e.g. to warm them up.
+
+        :param method: The name of the method.
+        :param args: The positional arguments of the method.
+        """
+        # Take all workers so that every one of them gets exactly one call
+        connections = [self._idle.get() for _ in range(self.workers)]
+        results = [None] * len(connections)
+        try:
+            for index, connection in enumerate(connections):
+                try:
+                    connection.send((method, args))
+                except OSError:
+                    connections[index] = self._replace_worker(connection)
+                    results[index] = (False, "the process exited")
+            for index, connection in enumerate(connections):
+                if results[index] is not None:
+                    continue
+                try:
+                    # The workers run at the same time, so every one gets the full timeout
+                    if not connection.poll(self.timeout):
+                        connections[index] = self._replace_worker(connection)
+                        results[index] = (False, f"the process did not answer within {self.timeout}s")
+                        continue
+                    results[index] = connection.recv()
+                except (EOFError, OSError):
+                    connections[index] = self._replace_worker(connection)
+                    results[index] = (False, "the process exited")
+        finally:
+            for connection in connections:
+                self._idle.put(connection)
+
+        for success, result in results:
+            if not success:
+                raise RuntimeError(f"{self.name} process failed: {result}")
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        for connection in self._connections.values():
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self._processes.values():
+            process.join(timeout=5)
@@ -0,0 +1,165 @@
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Set, Tuple
+
+import numpy as np
+
+from bot.db import DuckDBHandler
+from bot.metrics import MetricsRegistry
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class CachedResult:
+    def __init__(self, created_at: float):
+        """
+        Initializes the results computed for one text. A field stays None
+        until its stage has run on the text.
+
+        :param created_at: The POSIX time the first result was stored.
+        """
+        self.created_at = created_at
+        self.lemmas: Optional[frozenset] = None
+        self.category: Optional[int] = None
+        self.embedding: Optional[np.ndarray] = None
+
+class ResultCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 3600,
+                 db_handler: Optional[DuckDBHandler] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initializes the content-addressed cache of lemmatization and
+        classification results. Texts are identified by the hash of their
+        preprocessed form, so a text reposted by several channels is only
+        lemmatized and classified once.
+
+        :param max_size: The maximum number of texts, the least recently used
+                         are evicted first. 0 disables the cache.
+        :param ttl: The time in seconds a result is kept.
+        :param db_handler: Database handler to persist the results in, None
+                           keeps them in memory only.
+        :param metrics: Registry for the hit and miss counters.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_handler = db_handler
+        self.metrics = metrics or MetricsRegistry()
+        self.lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._changed: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Returns the cache key of a preprocessed text.
+
+        :param text: The preprocessed text.
+        :returns: The hex digest of the text.
+        """
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str, *fields: str, partial: bool = False) -> Optional[Tuple[Any, ...]]:
+        """
+        Returns the cached results of a text if all requested fields are known.
+        Every call counts as one hit or miss, so a message should look its
+        text up once.
+
+        :param key: The cache key of the text.
+        :param fields: The names of the fields, e.g. "lemmas" or "category".
+        :param partial: Whether to return the known fields with None for the
+                        others. It counts as a hit if any field is known,
+                        since that result is reused.
+        :returns: A tuple with the values of the fields, or None on a miss.
+        """
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.created_at > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            values = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                values = tuple(getattr(entry, field) for field in fields)
+
+        if values is not None and not partial and any(value is None for value in values):
+            values = None
+        hit = values is not None and any(value is not None for value in values)
+        self.metrics.increment("result_cache_hits" if hit else "result_cache_misses")
+        return values if hit else None
+
+    def put(self, key: str, **fields: Any) -> None:
+        """
+        Stores results of a text, keeping the fields stored before.
+
+        :param key: The cache key of the text.
+        :param fields: The values by field name, e.g. lemmas=... or category=...
+        """
+        if not self.max_size:
+            return
+
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = CachedResult(time.time())
+            self._entries.move_to_end(key)
+            for field, value in fields.items():
+                setattr(entry, field, frozenset(value) if field == "lemmas" else value)
+            self._changed.add(key)
+
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._changed.discard(evicted)
+
+    def load(self) -> None:
+        """Restores the persisted results that have not expired."""
+        if self.db_handler is None or not self.max_size:
+            return
+
+        since = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+        rows = self.db_handler.get_cached_results(since, self.max_size)
+        with self.lock:
+            # The rows come newest first, so the newest end up most recently used
+            for key, lemmas, category, embedding, created_at in reversed(rows):
+                entry = self._entries[key] = CachedResult(created_at.timestamp())
+                entry.lemmas = frozenset(lemmas) if lemmas is not None else None
+                entry.category = category
+                entry.embedding = np.array(embedding, dtype=np.float32) if embedding else None
+        logger.info(f"Loaded {len(rows)} cached result(s).")
+
+    def flush(self) -> None:
+        """
+        Removes expired results and writes the results changed since the
+        last flush to the database.
+        """
+        before = time.time() - self.ttl
+        with self.lock:
+            # Entries are ordered by use, not by age, so all of them are checked
+            for key in [key for key, entry in self._entries.items() if entry.created_at < before]:
+                del self._entries[key]
+                self._changed.discard(key)
+            changed, self._changed = self._changed, set()
+            rows = [(key, sorted(entry.lemmas) if entry.lemmas is not None else None,
+                     entry.category,
+                     entry.embedding.tolist() if entry.embedding is not None else None,
+                     datetime.datetime.fromtimestamp(entry.created_at))
+                    for key, entry in ((key, self._entries[key]) for key in changed)]
+        if self.db_handler is None:
+            return
+
+        try:
+            if rows:
+                self.db_handler.upsert_cached_results(rows)
+            self.db_handler.delete_cached_results(datetime.datetime.fromtimestamp(before))
+        except Exception:
+            # Keep the changes so the next flush retries them
+            with self.lock:
+                self._changed.update(key for key in changed if key in self._entries)
+            raise
@@ -0,0 +1,91 @@
+import os
+import logging
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+from bot.config import MainConfig, TelegramConfig
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+class RoutingTable:
+    def __init__(self, excluded_channels: frozenset, excluded_categories: frozenset,
+                 topics: Mapping[int, int]):
+        """
+        Initializes the immutable routing decisions of the message pipeline.
+        A new table replaces the old one as a whole when the configuration
+        changes, so a message is routed by one version of it.
+
+        :param excluded_channels: The IDs of the channels that are never processed.
+        :param excluded_categories: The categories that are never forwarded.
+        :param topics: The forum topic ID by category.
+        """
+        self.excluded_channels = excluded_channels
+        self.excluded_categories = excluded_categories
+        self.topics = MappingProxyType(dict(topics))
+
+    @classmethod
+    def from_config(cls, config: MainConfig, telegram_config: TelegramConfig) -> "RoutingTable":
+        """
+        Compiles the routing table from the configuration.
+
+        :param config: Main configuration object with global settings.
+        :param telegram_config: Telegram-specific configuration object.
+        :returns: The routing table.
+        """
+        return cls(
+            frozenset(config.exclude_channels),
+            frozenset(config.exclude_categories),
+            # The first topic of a category wins, as with the lookup in the list
+            {topic["category"]: topic["id"] for topic in reversed(telegram_config.topics)}
+        )
+
+    def accepts_channel(self, channel_id: int) -> bool:
+        """
+        Checks whether the messages of a channel are processed.
+
+        :param channel_id: The ID of the channel.
+        :returns: False if the channel is excluded.
+        """
+        return channel_id not in self.excluded_channels
+
+    def topic_for(self, category: int) -> Optional[int]:
+        """
+        Returns the forum topic of a category.
+
+        :param category: The category of the message.
+        :returns: The topic ID, or None if the category has no topic.
+        """
+        return self.topics.get(category)
+
+    def describe(self) -> str:
+        """Returns a short summary of the table for the logs."""
+        return (f"{len(self.excluded_channels)} excluded channel(s), "
+                f"{len(self.excluded_categories)} excluded category(ies), {len(self.topics)} topic(s)")
+
+def file_version(*paths: str) -> Tuple:
+    """
+    Returns a value that changes whenever one of the files is written.
+
+    :param paths: The paths of the files.
+    :returns: The modification times and sizes of the files.
+    """
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+def load_routing(config_path: str, telegram_config_path: str) -> RoutingTable:
+    """
+    Reads the configuration files again and compiles a new routing table.
+    The configuration objects used by the rest of the bot are not changed.
+
+    :param config_path: The main configuration file.
+    :param telegram_config_path: The Telegram-specific configuration file.
+    :returns: The routing table.
+    """
+    return RoutingTable.from_config(MainConfig(config_path), TelegramConfig(telegram_config_path))
@@ -1,24 +1,39 @@
+import time
 import logging
 import asyncio
-from typing import Dict, List
+import functools
+from typing import Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from telethon import TelegramClient
 from telethon.events import NewMessage
 from telethon.tl.functions.channels import CreateChannelRequest, CreateForumTopicRequest
-from telethon.tl.functions.messages import ForwardMessagesRequest
 
 from bot.db import DuckDBHandler
-from bot.classifier import TextClassifier
+from bot.metrics import MetricsRegistry
+from bot.albums import AlbumAssembler
+from bot.admission import FairQueue
+from bot.forwarding import ForwardingScheduler
+from bot.backfill import Backfill, ChannelProgress
+from bot.message_window import create_message_window
+from bot.dedup_service import DedupClient, RemoteMessageWindow, RemoteTokenBucket, shard_of
+from bot.result_cache import ResultCache
+from bot.routing import RoutingTable, file_version, load_routing
+from bot.cascade import CascadeClassifier
+from bot.models import Models, start_loading_models, warm_up
+from bot.batching import BatchingClassifier, MicroBatcher
 from bot.preprocess import preprocess_text
-from bot.text_similarity import TextSimilarity
 from bot.config import MainConfig, TelegramConfig
 
 # Setting up logging
 logger = logging.getLogger(__name__)
 
+# The time in seconds between checks whether shard 0 has created the forum
+FORUM_WAIT_INTERVAL = 5
+
 class TelegramManager:
     def __init__(self, config: MainConfig, telegram_config: TelegramConfig, 
-                 db_handler: DuckDBHandler, is_only_login: bool = False):
+                 db_handler: DuckDBHandler, is_only_login: bool = False, shard: int = 0):
         """
         Initialize TelegramManager with config and Telegram client.
         
@@ -26,10 +41,16 @@ class TelegramManager:
         :param telegram_config: Telegram-specific configuration object.
         :param db_handler: Database handler for managing message storage and retrieval.
         :param is_login_only: Flag indicating if only login is required (skips full startup).
+        :param shard: The index of this process when the channels are split into shards.
         """
         self.config = config
         self.telegram_config = telegram_config
         self.db_handler = db_handler
+        self.shard = shard
+
+        # Load the models in the background while the client connects and the
+        # forum is set up
+        models = None if is_only_login else start_loading_models(config)
         
         # Initialize and start the Telegram client
         self.client = self._initialize_client()
@@ -38,14 +59,25 @@ class TelegramManager:
         if is_only_login:
             return
         
-        # Set up forum management and message handling
-        self.forum_setup = ForumManager(self.client, config, telegram_config)
+        # Set up forum management and message handling. Only the first shard
+        # creates the forum and the topics
+        self.forum_setup = ForumManager(self.client, config, telegram_config, create=shard == 0)
         self.message_handler = MessageHandler(self.client, config, 
-                                              telegram_config, db_handler)
+                                              telegram_config, db_handler, models=models,
+                                              shard=shard)
 
         # Keep the client running until it is disconnected
         self.client.run_until_disconnected()
 
+        # Write the messages and the progress that are still pending to the database
+        self.message_handler.window.flush()
+        self.message_handler.progress.flush()
+        self.message_handler.result_cache.flush()
+
+        # Stop the inference processes, if any
+        if self.message_handler.models is not None:
+            self.message_handler.models.close()
+
     def _initialize_client(self) -> TelegramClient:
         """
         Initializes and returns the TelegramClient instance.
@@ -55,136 +87,453 @@ class TelegramManager:
         api_id = self.config.telegram.get("api_id")  # API ID for Telegram
         api_hash = self.config.telegram.get("api_hash")  # API hash for Telegram
         session_name = self.config.telegram.get("session_name")  # Session name
+        # A session can only be used by one process, so every other shard has its own
+        if self.shard:
+            session_name = f"{session_name}_shard{self.shard}"
         return TelegramClient(session_name, api_id, api_hash)
 
 class MessageHandler:
     def __init__(self, client: TelegramClient, config: MainConfig, 
-                 telegram_config: TelegramConfig, db_handler: DuckDBHandler):
+                 telegram_config: TelegramConfig, db_handler: DuckDBHandler,
+                 metrics: Optional[MetricsRegistry] = None, models: Optional[Future] = None,
+                 shard: int = 0):
         """
         Initialize the handler with the Telegram client and set up event handler
-        for new messages.
+        for new messages. Messages are buffered in the queue until the models
+        are loaded and warmed up.
 
         :param client: The Telegram client instance.
         :param config: Main configuration object with global settings.
         :param telegram_config: Telegram-specific configuration object.
         :param db_handler: Database handler for managing message storage and retrieval.
+        :param metrics: Registry for the timing spans of the pipeline stages.
+        :param models: Future of the models started by start_loading_models,
+                       None to start loading them here.
+        :param shard: The index of this process when the channels are split into shards.
         """
         self.client = client
         self.config = config
         self.telegram_config = telegram_config
         self.db_handler = db_handler
+        self.metrics = metrics or MetricsRegistry()
         self.message_lifetime = self.config.bot_settings.get("message_lifetime")
-
-        # Initialize the text classifier with the model path specified in the bot settings
-        self.classifier = TextClassifier(self.config.bot_settings.get("model_path"))
-        
-        # Initialize the TextSimilarity object for comparing message text similarity
-        self.text_similarity = TextSimilarity()
+        self.shard = shard
+        self.shards = self.config.bot_settings.get("shards", 1)
+
+        # Route messages by tables compiled from the configuration, which are
+        # replaced as a whole when the configuration files change
+        self.routing = RoutingTable.from_config(self.config, self.telegram_config)
+
+        # Start loading the models unless the caller already did. The workers
+        # wait for them, while everything else starts right away
+        if models is None:
+            models = start_loading_models(self.config)
+        self.ready = asyncio.Event()
+        self.models: Optional[Models] = None
+        self.batching_classifier: Optional[BatchingClassifier] = None
+        self.category_classifier = None
+        self.lemmatizer: Optional[MicroBatcher] = None
+
+        # In embedding mode the classifier also returns the sentence embeddings
+        # used for the similarity check, so no lemmatizer is loaded
+        self.use_embeddings = self.config.bot_settings.get("dedup_mode", "lemmas") == "embeddings"
+        if self.config.bot_settings.get("cascade_model_path") and self.use_embeddings:
+            logger.warning("The cascade classifier is ignored in embedding dedup mode.")
+
+        # Keep recent messages in memory and write them to the database in
+        # batches, or check them against the window of all shards kept by the
+        # dedup server
+        dedup_server = self.config.bot_settings.get("dedup_server")
+        self.dedup_client = DedupClient(dedup_server) if dedup_server else None
+        if self.dedup_client is not None:
+            self.window = RemoteMessageWindow(self.dedup_client, self.message_lifetime)
+        else:
+            self.window = create_message_window(self.config, self.db_handler)
+
+        # Reuse the lemmas and categories of texts that were already processed,
+        # e.g. the same press release reposted by several channels. Results
+        # expire together with the messages in the window
+        self.result_cache = ResultCache(
+            max_size=self.config.bot_settings.get("result_cache_size", 10000),
+            ttl=self.message_lifetime * 3600,
+            db_handler=self.db_handler if self.config.bot_settings.get("result_cache_persist", False) else None,
+            metrics=self.metrics
+        )
+        self.result_cache.load()
+
+        # Remember the last processed message of every channel to find the
+        # messages missed while the bot was not running
+        self.progress = ChannelProgress(self.db_handler)
+        self.flush_interval = self.config.bot_settings.get("flush_interval", 5)
+
+        # Set up the bounded executor that runs the CPU-bound pipeline stages
+        # (preprocessing and the checks against recent messages)
+        # so that the event loop only receives events and forwards messages
+        self.workers = self.config.bot_settings.get("workers", 16)
+        self.queue_size = self.config.bot_settings.get("queue_size", 100)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, 
+                                           thread_name_prefix="pipeline")
+
+        # Queue messages per channel and let the channels take turns, so a
+        # burst of one channel does not hold up the others. At most `workers`
+        # messages are processed at a time
+        self.queue = FairQueue(
+            capacity=self.queue_size,
+            policy=self.config.bot_settings.get("overload_policy", "delay"),
+            weights=self.config.bot_settings.get("channel_weights", {}),
+            metrics=self.metrics,
+            max_delayed=self.config.bot_settings.get("max_delayed")
+        )
+
+        # Collect the parts of albums from the incoming events so that every
+        # album is processed and forwarded once
+        self.albums = AlbumAssembler(
+            self._queue_message,
+            timeout_ms=self.config.bot_settings.get("album_timeout_ms", 500),
+            metrics=self.metrics
+        )
+
+        # Forward accepted messages in the background, merged per channel and
+        # topic and limited to a steady request rate
+        self.forwarder = ForwardingScheduler(
+            self.client,
+            self.db_handler,
+            self.telegram_config.forum_id,
+            rate=self.config.bot_settings.get("forward_rate", 1.0),
+            burst=self.config.bot_settings.get("forward_burst", 5),
+            coalesce_ms=self.config.bot_settings.get("forward_coalesce_ms", 500),
+            max_retries=self.config.bot_settings.get("forward_max_retries", 5),
+            metrics=self.metrics,
+            # All shards forward with the same account, so they share its rate limit
+            limiter=RemoteTokenBucket(self.dedup_client) if self.dedup_client is not None else None
+        )
+
+        # Start the workers that move queued messages through the pipeline
+        # once the models are ready
+        self.startup = self.client.loop.create_task(self._start_models(models))
+        for _ in range(self.workers):
+            self.client.loop.create_task(self._worker())
+        self.client.loop.create_task(self._flush_window())
+        self.client.loop.create_task(self.forwarder.run())
+
+        # Expose the queue depths and forwarding counters next to the stage timings
+        self.metrics.register_gauge("pipeline_queue_depth", self.queue.qsize)
+        self.metrics.register_gauge("pipeline_low_priority_depth", self.queue.low_priority_size)
+        self.metrics.register_gauge("pipeline_delayed_messages", self.queue.delayed)
+        self.metrics.register_gauge("pipeline_active_channels", lambda: len(self.queue.lengths()))
+        self.metrics.register_labeled_gauge("pipeline_channel_queue_depth", "channel", self.queue.lengths)
+        self.metrics.register_gauge("forward_queue_depth", self.forwarder.queue_depth)
+        self.metrics.register_gauge("result_cache_size", lambda: len(self.result_cache))
+        for name in ("requests", "messages", "flood_waits", "retries", "dropped"):
+            self.metrics.register_gauge(f"forward_{name}",
+                                        lambda name=name: self.forwarder.counters[name])
+        self.metrics.register_gauge("forward_wait_p95_seconds",
+                                    lambda: self.forwarder.stats()["wait_p95"])
+        self.client.loop.create_task(self._report_metrics())
+        self.client.loop.create_task(self._reload_config())
+
+        # Catch up on the messages published while the bot was not running.
+        # Live messages are checked against them by the message window
+        if self.config.bot_settings.get("backfill", True):
+            backfill = Backfill(
+                self.client,
+                self.progress,
+                # Missed messages wait for a free slot instead of being shed
+                functools.partial(self._queue_message, wait=True),
+                exclude_channels=self.routing.excluded_channels | {self.telegram_config.forum_id},
+                concurrency=self.config.bot_settings.get("backfill_concurrency", 4),
+                limit=self.config.bot_settings.get("backfill_limit", 500),
+                owns_channel=self.owns_channel
+            )
+            self.client.loop.create_task(backfill.run())
+        shard_info = f", shard {self.shard} of {self.shards}" if self.shards > 1 else ""
+        logger.info(f"Message pipeline started with {self.workers} worker(s) "
+                    f"and queue size {self.queue_size}{shard_info}.")
         
         # Add event handler for new messages
         self.client.add_event_handler(self.handler, NewMessage())
 
-    async def _get_grouped_message_ids(self, chat_id: int, grouped_id: int, 
-                                       timeout: float = 1.0, limit: int = 100) -> List[int]:
+    async def _start_models(self, models: Future) -> None:
         """
-        Retrieves message IDs that belong to the same group within a specific 
-        timeout period.
-        
-        :param chat_id: The ID of the chat where messages are collected.
-        :param grouped_id: The grouped ID to filter messages.
-        :param timeout: Time in seconds to collect messages (default is 1.0).
-        :param limit: The maximum number of messages to retrieve (default is 100).
-        :returns: A list of message IDs belonging to the group.
+        Waits for the models, builds the batching front ends around them and
+        warms them up before the workers start processing messages.
+
+        :param models: Future of the loaded models.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            models = self.models = await asyncio.wrap_future(models)
+
+            # Classify messages in micro-batches collected from all workers
+            batch_size = self.config.bot_settings.get("batch_size", 16)
+            self.batching_classifier = BatchingClassifier(
+                models.classifier,
+                max_batch_size=batch_size,
+                max_wait_ms=self.config.bot_settings.get("batch_timeout_ms", 10),
+                bucket_by_length=self.config.bot_settings.get("bucket_by_length", True),
+                embeddings=self.use_embeddings,
+                concurrency=Models.workers(models.classifier)
+            )
+
+            # Let the fast first-stage classifier answer confident messages if it is configured
+            self.category_classifier = self.batching_classifier
+            if models.fast_classifier is not None:
+                self.category_classifier = CascadeClassifier(
+                    models.fast_classifier,
+                    self.batching_classifier,
+                    threshold=self.config.bot_settings.get("cascade_threshold", 0.9),
+                    metrics=self.metrics,
+                    executor=self.executor
+                )
+
+            # Lemmatize messages in batches collected from all workers
+            if models.text_similarity is not None:
+                self.lemmatizer = MicroBatcher(
+                    models.text_similarity.get_lemmas_batch,
+                    max_batch_size=self.config.bot_settings.get("lemma_batch_size", 64),
+                    max_wait_ms=self.config.bot_settings.get("batch_timeout_ms", 10),
+                    name="lemmatizer",
+                    concurrency=Models.workers(models.text_similarity)
+                )
+
+            # Run the models once so the first message does not pay for their initialization
+            if self.config.bot_settings.get("warm_up", True):
+                await loop.run_in_executor(self.executor, warm_up, models, batch_size,
+                                           self.use_embeddings)
+        except Exception as e:
+            logger.error(f"Failed to load the models: {e}")
+            await self.client.disconnect()
+            raise
+
+        self.ready.set()
+        logger.info(f"Models are ready, processing {self.queue.qsize()} buffered message(s).")
+
+    async def _report_metrics(self) -> None:
+        """Serves the metrics over HTTP and periodically logs their summary."""
+        port = self.config.bot_settings.get("metrics_port", 9100)
+        if port:
+            try:
+                await self.metrics.serve(self.config.bot_settings.get("metrics_host", "127.0.0.1"), port)
+            except OSError as e:
+                logger.error(f"Failed to start the metrics server on port {port}: {e}")
+
+        interval = self.config.bot_settings.get("metrics_log_interval", 60)
+        while interval:
+            await asyncio.sleep(interval)
+            self.metrics.log_summary()
+
+    async def _reload_config(self) -> None:
         """
-        if grouped_id is None:
-            return []
-
-        ids = []
-        end_time = asyncio.get_event_loop().time() + timeout
-        async for message in self.client.iter_messages(chat_id, limit=limit):
-            if message.grouped_id == grouped_id:
-                ids.append(message.id)
-            if asyncio.get_event_loop().time() > end_time:
-                break
-        logger.info(f"Collected {len(ids)} messages with grouped ID {grouped_id}.")
-        return ids
+        Watches the configuration files and swaps in a new routing table
+        when they change. The models and the other settings are not reloaded.
+        """
+        interval = self.config.bot_settings.get("config_reload_interval", 5)
+        paths = (self.config.file_path, self.telegram_config.file_path)
+        version = file_version(*paths)
+        loop = asyncio.get_running_loop()
+        while interval:
+            await asyncio.sleep(interval)
+            current = file_version(*paths)
+            if current == version:
+                continue
+            version = current
+
+            try:
+                routing = await loop.run_in_executor(self.executor, load_routing, *paths)
+            except Exception as e:
+                logger.error(f"Failed to reload the configuration, keeping the previous one: {e}")
+                continue
+            self.routing = routing
+            self.metrics.increment("config_reloads")
+            logger.info(f"Configuration reloaded: {routing.describe()}.")
+
+    async def _flush_window(self) -> None:
+        """
+        Periodically writes new messages from the window and the channel
+        progress to the database.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                with self.metrics.timer("insert"):
+                    await loop.run_in_executor(self.executor, self.window.flush)
+                await loop.run_in_executor(self.executor, self.progress.flush)
+                await loop.run_in_executor(self.executor, self.result_cache.flush)
+            except Exception as e:
+                logger.error(f"Failed to flush messages to the database: {e}")
+
+    def owns_channel(self, channel_id: int) -> bool:
+        """
+        Checks whether the messages of a channel are processed by this shard.
+
+        :param channel_id: The ID of the channel.
+        :returns: True if this shard processes the channel.
+        """
+        return self.shards <= 1 or shard_of(channel_id, self.shards) == self.shard
 
     async def handler(self, event: NewMessage) -> None:
         """
-        Handles new incoming messages by processing, checking for similarity, 
-        and forwarding them.
+        Receives new incoming messages and queues them for processing. 
+        Parts of albums are collected first and queued as one message.
+        When the queue is full, the overload policy decides whether to wait
+        for a free slot or to shed an older message.
         
         :param event: The event triggered by a new incoming message.
         """
-        # Skip messages that do not belong to a channel, messages from excluded channels or empty messages
-        if not event.is_channel or event.chat_id in self.config.exclude_channels \
-           or event.message.text == "":
+        # Skip messages that do not belong to a channel or messages from excluded channels
+        if not event.is_channel:
+            return
+        if not self.routing.accepts_channel(event.chat_id):
+            self.metrics.increment("skipped_excluded_channel")
             return
+        # Every shard receives all messages, but processes only its own channels
+        if not self.owns_channel(event.chat_id):
+            return
+        self.metrics.increment("received")
 
-        # Check if the message has already been processed
-        if self.db_handler.check_message_exists(event.message.id, event.chat_id, 
-                                                event.message.grouped_id):
-            logger.info(f"Message {event.message.id} already processed. Skipping.")
+        # Album parts without a caption are still needed for their IDs
+        if event.message.grouped_id is not None:
+            self.albums.add(event)
             return
 
-        # Preprocess the post text and extract lemmas for similarity check
-        post_text = event.message.text
-        clear_post_text = preprocess_text(post_text)
-        text_lemma = self.text_similarity.get_lemmas(clear_post_text)
-        
-        # Get recent lemmas from the database and check for similarity
-        lemma_list = self.db_handler.get_recent_messages_lemmas(self.message_lifetime)
-        if self.text_similarity.is_similar_to_last_messages(text_lemma, lemma_list):
-            logger.info(f"Text is similar to recent messages. Skipping message {event.message.id}.")
+        # Skip empty messages
+        if event.message.text == "":
             return
+
+        await self._queue_message(event, [event.message.id])
+
+    async def _queue_message(self, event: NewMessage, message_ids: List[int], wait: bool = False) -> None:
+        """
+        Queues a message or an album for processing in the queue of its channel.
+
+        :param event: The event of the message that carries the text.
+        :param message_ids: The IDs of all messages to forward together.
+        :param wait: Whether to wait for a free slot whatever the overload policy is.
+        """
+        await self.queue.put(event.chat_id, (event, message_ids, time.perf_counter()), wait)
+
+    async def _worker(self) -> None:
+        """Takes messages from the queue and processes them one at a time."""
+        await self.ready.wait()
+        while True:
+            event, message_ids, queued_at = await self.queue.get()
+            self.metrics.observe("queue_wait", time.perf_counter() - queued_at)
+            try:
+                with self.metrics.timer("total"):
+                    await self._handle_event(event, message_ids)
+            except Exception as e:
+                logger.error(f"Failed to process message {event.message.id}: {e}")
+            else:
+                self.progress.update(event.chat_id, max(message_ids))
+            finally:
+                self.queue.task_done()
+
+    async def _handle_event(self, event: NewMessage, message_ids: List[int]) -> None:
+        """
+        Runs the CPU-bound stages of the pipeline in the executor and forwards
+        the message if it was accepted.
         
-        # Insert the message into the database
-        self.db_handler.insert_message(event.message.id, event.chat_id, 
-                                       event.message.grouped_id, clear_post_text, 
-                                       list(text_lemma), event.date)
+        :param event: The event triggered by a new incoming message.
+        :param message_ids: The IDs of all messages to forward together.
+        """
+        loop = asyncio.get_running_loop()
+        message_id, chat_id = event.message.id, event.chat_id
+        grouped_id = event.message.grouped_id
+        # Route the whole message with the table that is current now
+        routing = self.routing
+
+        # Check if the message has already been processed. With a dedup
+        # server this asks the window shared by all shards
+        if await loop.run_in_executor(self.executor, self.window.contains,
+                                      message_id, chat_id, grouped_id):
+            logger.info(f"Message {message_id} already processed. Skipping.")
+            self.metrics.increment("skipped_duplicate")
+            return
+
+        # Preprocess the post text
+        with self.metrics.timer("preprocess"):
+            clear_post_text = await loop.run_in_executor(self.executor, preprocess_text, 
+                                                         event.message.text)
+
+        # Extract lemmas for similarity check, or classify the message and get
+        # its embedding in one forward pass, unless the same text was seen before
+        cache_key = ResultCache.key(clear_post_text)
+        text_lemma, embedding, category = set(), None, None
+        if self.use_embeddings:
+            cached = self.result_cache.get(cache_key, "category", "embedding")
+            if cached is not None:
+                category, embedding = cached
+            else:
+                logger.info(f"Classifying message text: {event.message.text[:20]}...")
+                with self.metrics.timer("classify"):
+                    category, embedding = await self.batching_classifier.classify_with_embedding(clear_post_text)
+                self.result_cache.put(cache_key, category=category, embedding=embedding)
+        else:
+            # The category is looked up together with the lemmas and used after the dedup check
+            cached = self.result_cache.get(cache_key, "lemmas", "category", partial=True)
+            if cached is not None:
+                text_lemma, category = cached
+            if cached is None or text_lemma is None:
+                with self.metrics.timer("lemmatize"):
+                    text_lemma = await self.lemmatizer.submit(clear_post_text)
+                self.result_cache.put(cache_key, lemmas=text_lemma)
+
+        # Check the message against the recent ones and remember it if it is new
+        with self.metrics.timer("dedup"):
+            skip_reason = await loop.run_in_executor(
+                self.executor, self.window.add_if_new, message_id, chat_id, grouped_id, 
+                clear_post_text, text_lemma, event.date, embedding
+            )
+        if skip_reason is not None:
+            self.metrics.increment(f"skipped_{skip_reason}")
+        if skip_reason == "duplicate":
+            logger.info(f"Message {message_id} already processed. Skipping.")
+            return
+        if skip_reason == "similar":
+            logger.info(f"Text is similar to recent messages. Skipping message {message_id}.")
+            return
 
         # Classify the message into a category
-        logger.info(f"Classifying message text: {post_text[:20]}...")
-        category = self.classifier.classify_text(clear_post_text)
-        if category in self.config.exclude_categories:
+        if category is None:
+            logger.info(f"Classifying message text: {event.message.text[:20]}...")
+            with self.metrics.timer("classify"):
+                category = await self.category_classifier.classify(clear_post_text)
+            self.result_cache.put(cache_key, category=category)
+        if category in routing.excluded_categories:
             logger.info(f"Message belongs to excluded category {category}. Skipping.")
+            self.metrics.increment("skipped_excluded_category")
             return
 
         # Find the topic ID for the category
-        topic_id = next((topic["id"] for topic in self.telegram_config.topics if
-                         topic["category"] == category), None)
+        topic_id = routing.topic_for(category)
         if not topic_id:
             logger.warning(f"No topic found for category {category}. Skipping forwarding.")
+            self.metrics.increment("skipped_missing_topic")
             return
 
-        # Collect grouped messages if applicable
-        message_ids = await self._get_grouped_message_ids(event.chat_id, 
-                                                          event.message.grouped_id)
-
-        # Forward messages to the forum under the specific topic
-        await self.client(ForwardMessagesRequest(
-            from_peer=event.chat_id,
-            id=message_ids or [event.message.id],
-            to_peer=self.telegram_config.forum_id,
-            top_msg_id=topic_id,
-        ))
-
-        logger.info(f"Successfully forwarded message {event.message.id}"
-                    f"to the forum under topic {topic_id}.")
+        # Queue the messages for forwarding to the forum under the specific topic
+        with self.metrics.timer("forward"):
+            await self.forwarder.submit(event.chat_id, message_ids, topic_id)
+        self.metrics.increment("accepted")
+        logger.info(f"Queued message {event.message.id} for forwarding under topic {topic_id}.")
 
 class ForumManager:
     def __init__(self, client: TelegramClient, config: MainConfig, 
-                 telegram_config: TelegramConfig):
+                 telegram_config: TelegramConfig, create: bool = True):
         """
         Initialize the ForumManager to handle forum and topic setup.
 
         :param client: The Telegram client instance.
         :param config: The main configuration object.
         :param telegram_config: The Telegram-specific configuration object.
+        :param create: Whether missing forum and topics are created, False
+                       only checks that the forum exists.
         """
         self.client = client
         self.config = config
         self.telegram_config = telegram_config
+        self.create = create
 
         # Setup forum and topics during initialization
         asyncio.get_event_loop().run_until_complete(self.setup_forum_and_topics())
@@ -252,6 +601,16 @@ class ForumManager:
     async def setup_forum_and_topics(self) -> None:
         """Ensures the forum and topics are created if they are not already present."""
         logger.info("Checking if forum and topics need to be created.")
+        if not self.create:
+            # The first shard creates the forum and writes its ID to the shared configuration
+            if self.telegram_config.forum_id is None:
+                logger.info(f"Waiting for shard 0 to create the forum and write its ID "
+                            f"to {self.telegram_config.file_path}.")
+            while self.telegram_config.forum_id is None:
+                await asyncio.sleep(FORUM_WAIT_INTERVAL)
+                self.telegram_config.load()
+            return
+
         # Create forum if it doesn't exist
         if self.telegram_config.forum_id is None:
             logger.info("Forum does not exist, creating now.")
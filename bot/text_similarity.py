@@ -1,14 +1,112 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Sequence
+
 import spacy
 
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+# Pipeline components that do not influence lemmas or stop words
+DEFAULT_EXCLUDE = ("parser", "ner", "senter")
+
 class TextSimilarity:
-    def __init__(self, language_model='ru_core_news_sm'):
+    def __init__(self, language_model='ru_core_news_sm', engine: str = "model",
+                 exclude: Sequence[str] = DEFAULT_EXCLUDE, cache_size: int = 100000,
+                 batch_size: int = 64):
         """
         Initializes the TextSimilarity class with the specified language model.
         
         :param language_model: The language model to be used by spaCy. Default is 'ru_core_news_sm'.
+        :param engine: "model" lemmatizes with the spaCy pipeline, "lookup" only
+                       tokenizes and looks every token up in the pymorphy3
+                       dictionary. "lookup" ignores the part of speech, so
+                       its lemmas and the dedup results can differ from "model".
+        :param exclude: The pipeline components not loaded in "model" mode.
+        :param cache_size: The maximum number of cached token lemmas, 0 to disable.
+        :param batch_size: The number of texts spaCy processes at once.
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._lemmatizer = None
+        start_time = time.perf_counter()
+
+        if engine == "lookup":
+            # Only the tokenizer and lexical attributes such as stop words are needed
+            self.nlp = spacy.blank(language_model.split("_")[0])
+        else:
+            # Load the spaсy language model without the components the lemmatizer does not need
+            self.nlp = spacy.load(language_model, exclude=list(exclude))
+            if cache_size and "lemmatizer" in self.nlp.pipe_names:
+                # The lemmatizer is called per token in get_lemmas_batch, so that
+                # tokens with the same text and morphology are looked up once
+                self._lemmatizer = self.nlp.get_pipe("lemmatizer")
+                self.nlp.disable_pipe("lemmatizer")
+        self._init_caches()
+
+        logger.info(f"Lemma engine '{engine}' loaded in {time.perf_counter() - start_time:.2f}s "
+                    f"with components {self.nlp.pipe_names}.")
+
+    def _init_caches(self) -> None:
+        """Creates the lemma caches and the dictionary of the "lookup" engine."""
+        if self.engine == "lookup":
+            from pymorphy3 import MorphAnalyzer
+
+            self._morph = MorphAnalyzer(lang=self.nlp.lang)
+            self._lookup_lemma = lru_cache(maxsize=self.cache_size)(self._lookup_lemma)
+        elif self._lemmatizer is not None:
+            self._lemma_cache: "OrderedDict[tuple, str]" = OrderedDict()
+            self._lemma_cache_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """Leaves out the caches and the lock when the object is sent to a worker process."""
+        state = self.__dict__.copy()
+        for name in ("_morph", "_lookup_lemma", "_lemma_cache", "_lemma_cache_lock"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restores the object in a worker process with empty caches."""
+        self.__dict__.update(state)
+        self._init_caches()
+
+    def _lookup_lemma(self, word: str) -> str:
         """
-        # Load the spaсy language model for NLP tasks
-        self.nlp = spacy.load(language_model)
+        Looks the word up in the pymorphy3 dictionary, the same way spaCy does
+        for words without a part of speech.
+
+        :param word: The token text.
+        :returns: The normal form if all analyses agree on it, otherwise the word.
+        """
+        normal_forms = {analysis.normal_form for analysis in self._morph.parse(word)}
+        return next(iter(normal_forms)) if len(normal_forms) == 1 else word
+
+    def _model_lemma(self, token) -> str:
+        """
+        Returns the lemma the spaCy lemmatizer gives the token. The lemma only
+        depends on the text, the part of speech and the morphology of the
+        token, so it is cached by them and the result does not change.
+
+        :param token: The token tagged by the spaCy pipeline.
+        :returns: The lemma of the token.
+        """
+        key = (token.text, token.pos, str(token.morph))
+        with self._lemma_cache_lock:
+            lemma = self._lemma_cache.get(key)
+            if lemma is not None:
+                self._lemma_cache.move_to_end(key)
+                return lemma
+
+        lemma = self._lemmatizer.lemmatize(token)[0]
+        with self._lemma_cache_lock:
+            self._lemma_cache[key] = lemma
+            if len(self._lemma_cache) > self.cache_size:
+                self._lemma_cache.popitem(last=False)
+        return lemma
 
     def get_lemmas(self, text: str) -> set:
         """
@@ -18,9 +116,29 @@ class TextSimilarity:
         :param text: The input text for lemma extraction.
         :returns: A set of lemmatized tokens.
         """
-        # Process the text and extract lemmas (excluding stop words and punctuation)
-        doc = self.nlp(text)
-        return {token.lemma_ for token in doc if not token.is_stop and not token.is_punct}
+        return self.get_lemmas_batch([text])[0]
+
+    def get_lemmas_batch(self, texts: List[str]) -> List[set]:
+        """
+        Extracts the sets of lemmatized tokens from several texts at once,
+        excluding stop words and punctuation.
+
+        :param texts: The input texts for lemma extraction.
+        :returns: A list with a set of lemmatized tokens for every text.
+        """
+        lemmas = []
+        # Process the texts and extract lemmas (excluding stop words and punctuation)
+        for doc in self.nlp.pipe(texts, batch_size=self.batch_size):
+            if self.engine == "lookup":
+                lemmas.append({self._lookup_lemma(token.text) for token in doc
+                               if not token.is_stop and not token.is_punct})
+            elif self._lemmatizer is not None:
+                lemmas.append({self._model_lemma(token) for token in doc
+                               if not token.is_stop and not token.is_punct})
+            else:
+                lemmas.append({token.lemma_ for token in doc
+                               if not token.is_stop and not token.is_punct})
+        return lemmas
 
     def calculate_similarity(self, first_lemmas: set, second_lemmas: set, 
                              threshold: float = 0.1) -> bool:
@@ -0,0 +1,106 @@
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+from typing import List
+
+from bot.logger import setup_logger
+from bot.preprocess import preprocess_text
+from bot.corpus import DEFAULT_CORPUS_PATH, iter_corpus
+
+# Setting up logging
+logger = logging.getLogger(__name__)
+
+def _reference_preprocess_text(text: str) -> str:
+    """
+    The original chain of substitutions, which preprocess_text must match
+    exactly.
+
+    :param text: The raw input text to preprocess.
+    :returns: The preprocessed text.
+    """
+    text = re.sub(r"<.*?>", "", text)
+    text = re.sub(r"(\*\*|__)(.*?)\1", r"\2", text)
+    text = re.sub(r"(\*|_)(.*?)\1", r"\2", text)
+    text = re.sub(r"~~(.*?)~~", r"\1", text)
+    text = re.sub(r"`{1,2}(.*?)`{1,2}", r"\1", text)
+    text = re.sub(r"#{1,6}\s*", "", text)
+    text = re.sub(r"\[(.*?)\]\(.*?\)", r"\1", text)
+    text = re.sub(r"!\[.*?\]\(.*?\)", "", text)
+    text = re.sub(r">\s*", "", text)
+    text = re.sub(r"[^a-zA-Zа-яА-ЯёЁ\s]", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.lower()
+
+def random_texts(count: int, seed: int = 0) -> List[str]:
+    """
+    Generates short texts dense in Markdown/HTML syntax, whitespace and
+    mixed scripts, where the steps of the preprocessing interact.
+
+    :param count: The number of texts.
+    :param seed: The seed of the random generator.
+    :returns: A list of texts.
+    """
+    rng = random.Random(seed)
+    alphabet = (["*", "**", "_", "__", "~~", "`", "``", "#", "##", ">", "<", "</b>", "[", "]", "(", ")",
+                 "](", "![", " ", "  ", "\n", "\t", " ", " ", "\x1c", "ab", "Ёж", "ЩИТ",
+                 "İ", "ß", "1", "-", ".", "😀"])
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(count)]
+
+def _time(function, texts: List[str], repeat: int) -> float:
+    """
+    Returns the best time of preprocessing all texts with the function.
+
+    :param function: The preprocessing function.
+    :param texts: The raw texts.
+    :param repeat: The number of runs.
+    :returns: The time of the fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+def main() -> None:
+    # Set up the logger
+    setup_logger()
+
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Check the text preprocessing against the original "
+                                                 "implementation and measure its speed.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH, help="Directory with messages.")
+    parser.add_argument('--random', type=int, default=100000, help="Number of generated texts to check.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of the speed measurement.")
+    args = parser.parse_args()
+
+    corpus = [message["text"] for message in iter_corpus(args.corpus)]
+    generated = random_texts(args.random)
+
+    # Compare the output of both implementations on every text
+    mismatches = 0
+    for text in corpus + generated:
+        expected = _reference_preprocess_text(text)
+        if preprocess_text(text) != expected:
+            mismatches += 1
+            if mismatches <= 10:
+                logger.error(f"Mismatch for {text!r}: {preprocess_text(text)!r} != {expected!r}")
+    logger.info(f"Checked {len(corpus)} corpus and {len(generated)} generated texts, "
+                f"{mismatches} mismatch(es).")
+
+    reference_time = _time(_reference_preprocess_text, corpus, args.repeat)
+    fused_time = _time(preprocess_text, corpus, args.repeat)
+    logger.info(f"Original: {reference_time * 1e6 / len(corpus):.1f} us/text, "
+                f"preprocess_text: {fused_time * 1e6 / len(corpus):.1f} us/text "
+                f"({reference_time / fused_time:.2f}x).")
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import os
 import json
+import asyncio
 import logging
-from typing import List, Dict
+import argparse
+from typing import Dict
 
+from telethon import TelegramClient
 from telethon.tl.types import Message
-from telethon.sync import TelegramClient
 from telethon.tl.custom.dialog import Dialog
 
 # Replace with your API ID and API Hash
@@ -16,79 +18,165 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants
-OUTPUT_FILE_TEMPLATE = "{}_messages.json"
-MESSAGE_LIMIT = 3000  # Default message limit
+OUTPUT_FILE_TEMPLATE = "{}_messages.jsonl"
+LEGACY_FILE_TEMPLATE = "{}_messages.json"  # Files written by older versions
+MESSAGE_LIMIT = 3000  # Default number of messages fetched on the first export of a channel
+CONCURRENCY = 4  # Default number of channels fetched at the same time
 
+# Bytes read at a time while looking for the last line of a file
+TAIL_BLOCK_SIZE = 64 * 1024
 
-async def fetch_channel_messages(client: TelegramClient, channel: Dialog) -> List[Dict]:
+
+def last_exported_id(file_path: str) -> int:
     """
-    Fetch messages from a specific Telegram channel.
+    Returns the ID of the last message in a JSONL export. Messages are
+    written oldest first, so it is the ID in the last line. A last line cut
+    off by an interrupted run is removed.
 
-    :param client: Instance of the Telegram client.
-    :param channel: The channel from which to fetch messages.
-    :returns: A list of dictionaries containing message details.
+    :param file_path: Path to the JSONL file.
+    :returns: The message ID, or 0 if the file has no messages.
+    """
+    if not os.path.exists(file_path):
+        return 0
+
+    with open(file_path, 'rb+') as file:
+        end = file.seek(0, os.SEEK_END)
+        tail, position = b"", end
+        # Read blocks from the end until the tail holds a complete line
+        while position > 0 and tail.count(b"\n") < 2:
+            position = max(0, position - TAIL_BLOCK_SIZE)
+            file.seek(position)
+            tail = file.read(end - position)
+
+        if tail and not tail.endswith(b"\n"):
+            complete = tail.rfind(b"\n") + 1
+            logger.warning(f"Removing an incomplete last line from {file_path}")
+            file.truncate(position + complete)
+            tail = tail[:complete]
+
+    lines = tail.splitlines()
+    return json.loads(lines[-1])['message_id'] if lines else 0
+
+
+def legacy_exported_id(file_path: str) -> int:
+    """
+    Returns the highest message ID in a JSON export of an older version.
+
+    :param file_path: Path to the JSON file.
+    :returns: The message ID, or 0 if the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        return 0
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return max((message['message_id'] for message in json.load(file)), default=0)
+
+
+async def first_message_id(client: TelegramClient, channel: Dialog, limit: int) -> int:
     """
-    logger.info(f"Fetching the last {MESSAGE_LIMIT} messages from channel: {channel.name}")
-    messages = []
+    Returns the ID before the oldest of the last messages of a channel, so
+    that the first export starts there.
 
-    async for message in client.iter_messages(channel.id, limit=MESSAGE_LIMIT):
-        if isinstance(message, Message) and message.text:
-            messages.append({
-                'message_id': message.id,
-                'sender_id': message.sender_id,
-                'text': message.text,
-                'date': message.date.isoformat(),
-                'channel': channel.name
-            })
+    :param client: Instance of the Telegram client.
+    :param channel: The channel to export.
+    :param limit: The number of recent messages to export.
+    :returns: The message ID to start after.
+    """
+    async for message in client.iter_messages(channel.id, limit=1, add_offset=limit - 1):
+        return message.id - 1
+    return 0
 
-    logger.info(f"Fetched {len(messages)} messages from channel: {channel.name}")
-    return messages
 
+def message_to_dict(message: Message, channel: Dialog) -> Dict:
+    """
+    Converts a message into the exported dictionary.
 
-def save_messages_to_file(messages: List[Dict], channel_id: int) -> None:
+    :param message: The Telegram message.
+    :param channel: The channel of the message.
+    :returns: A dictionary with the message details.
     """
-    Save messages to a JSON file.
+    return {
+        'message_id': message.id,
+        'sender_id': message.sender_id,
+        'text': message.text,
+        'date': message.date.isoformat(),
+        'channel': channel.name
+    }
 
-    :param messages: List of message dictionaries to save.
-    :param channel_id: ID of the channel (used for file naming).
+
+async def export_channel(client: TelegramClient, channel: Dialog, output_dir: str,
+                         limit: int, semaphore: asyncio.Semaphore) -> int:
     """
-    if not messages:
-        logger.warning("No messages to save.")
-        return
+    Appends the messages of a channel published since the last export to
+    its JSONL file, oldest first, one line per message.
 
-    file_path = OUTPUT_FILE_TEMPLATE.format(abs(channel_id))
+    :param client: Instance of the Telegram client.
+    :param channel: The channel to export.
+    :param output_dir: Directory of the exported files.
+    :param limit: The number of recent messages fetched on the first export.
+    :param semaphore: Limits the number of channels fetched at the same time.
+    :returns: The number of exported messages.
+    """
+    file_path = os.path.join(output_dir, OUTPUT_FILE_TEMPLATE.format(abs(channel.id)))
+    legacy_path = os.path.join(output_dir, LEGACY_FILE_TEMPLATE.format(abs(channel.id)))
 
-    # Load existing messages if the file exists
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            existing_messages = json.load(file)
-        messages.extend(existing_messages)
+    async with semaphore:
+        # Resume after the last exported message, or start with the recent ones
+        min_id = last_exported_id(file_path) or legacy_exported_id(legacy_path)
+        if not min_id:
+            min_id = await first_message_id(client, channel, limit)
+        logger.info(f"Exporting messages after {min_id} from channel: {channel.name}")
 
-    # Save all messages to the file
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(messages, file, ensure_ascii=False, indent=4)
+        count = 0
+        with open(file_path, 'a', encoding='utf-8') as file:
+            async for message in client.iter_messages(channel.id, min_id=min_id, reverse=True):
+                if isinstance(message, Message) and message.text:
+                    file.write(json.dumps(message_to_dict(message, channel), ensure_ascii=False) + "\n")
+                    count += 1
 
-    logger.info(f"Messages saved to {file_path}")
+    logger.info(f"Exported {count} new messages from channel {channel.name} to {file_path}")
+    return count
 
 
-async def process_channels(client: TelegramClient) -> None:
+async def process_channels(client: TelegramClient, output_dir: str, limit: int,
+                           concurrency: int) -> None:
     """
-    Process all channels the user has access to and fetch messages.
+    Process all channels the user has access to and export their new messages.
 
     :param client: Instance of the Telegram client.
+    :param output_dir: Directory of the exported files.
+    :param limit: The number of recent messages fetched on the first export of a channel.
+    :param concurrency: The number of channels fetched at the same time.
     """
     await client.start()
-    channels = [dialog for dialog in await client.get_dialogs() if dialog.is_channel]
+    os.makedirs(output_dir, exist_ok=True)
+    channels = [dialog async for dialog in client.iter_dialogs() if dialog.is_channel]
 
-    for channel in channels:
-        logger.info(f"Processing channel: {channel.name}")
-        messages = await fetch_channel_messages(client, channel)
-        save_messages_to_file(messages, channel.id)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(export_channel(client, channel, output_dir, limit, semaphore) for channel in channels),
+        return_exceptions=True
+    )
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to export channel {channel.name}: {result}")
+
+    exported = sum(result for result in results if not isinstance(result, Exception))
+    logger.info(f"Exported {exported} new messages from {len(channels)} channels.")
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the messages of all subscribed channels.")
+    parser.add_argument('--output-dir', default=".", help="Directory of the exported files.")
+    parser.add_argument('--limit', type=int, default=MESSAGE_LIMIT,
+                        help="Messages fetched on the first export of a channel.")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help="Channels fetched at the same time.")
+    args = parser.parse_args()
+
     client = TelegramClient('telegram_message_exporter', API_ID, API_HASH)
-    client.loop.run_until_complete(process_channels(client))
+    client.loop.run_until_complete(process_channels(client, args.output_dir, args.limit,
+                                                    args.concurrency))
 
 
 if __name__ == '__main__':